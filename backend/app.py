@@ -4,6 +4,7 @@ from flask_migrate import Migrate
 from models import db, User, AITask, GeneratedResult, SystemConfig
 from config import config
 from services.websocket_service import WebSocketService
+from services.upload_service import UploadRequest
 from celery_app import make_celery
 import os
 
@@ -11,6 +12,9 @@ def create_app(config_name='default'):
     app = Flask(__name__)
     app.config.from_object(config[config_name])
     
+    # 上传文件流式写入磁盘
+    app.request_class = UploadRequest
+    
     # 初始化扩展
     db.init_app(app)
     CORS(app)
@@ -1,4 +1,5 @@
 from celery import Celery
+from celery.signals import worker_process_shutdown
 from config import Config
 import os
 
@@ -7,7 +8,7 @@ def make_celery(app=None):
         'visual_matrix',
         broker=Config.CELERY_BROKER_URL,
         backend=Config.CELERY_RESULT_BACKEND,
-        include=['tasks.ai_tasks', 'tasks.health_check']
+        include=['tasks.ai_tasks', 'tasks.render_tasks', 'tasks.health_check']
     )
     
     if app:
@@ -35,6 +36,8 @@ celery.conf.update(
     task_routes={
         'tasks.ai_tasks.analyze_task': {'queue': 'analysis'},
         'tasks.ai_tasks.generate_task': {'queue': 'generation'},
+        'tasks.ai_tasks.poll_provider_jobs': {'queue': 'polling'},
+        'tasks.render_tasks.finalize_task': {'queue': 'render'},
         'tasks.health_check.check_api_health': {'queue': 'health'}
     },
     beat_schedule={
@@ -42,5 +45,21 @@ celery.conf.update(
             'task': 'tasks.health_check.check_api_health',
             'schedule': 300.0,  # 每5分钟检查一次
         },
+        'poll-provider-jobs': {
+            'task': 'tasks.ai_tasks.poll_provider_jobs',
+            'schedule': 60.0,  # 兜底轮询，防止排期消息丢失后作业无人处理
+        },
     }
-)
\ No newline at end of file
+)
+
+@worker_process_shutdown.connect
+def flush_websocket_buffers(**kwargs):
+    """worker子进程退出前发出合并窗口内尚未发送的推送"""
+    from services.websocket_service import WebSocketService
+    WebSocketService.flush_all()
+
+@worker_process_shutdown.connect
+def close_http_sessions(**kwargs):
+    """worker子进程退出前关闭复用的HTTP连接"""
+    from services.http_pool import HTTPSessionPool
+    HTTPSessionPool.close_all()
@@ -14,13 +14,47 @@ class Config:
     
     # Redis配置
     REDIS_URL = os.environ.get('REDIS_URL') or 'redis://localhost:6379/0'
+    REDIS_SOCKET_TIMEOUT = float(os.environ.get('REDIS_SOCKET_TIMEOUT', 2))
     CELERY_BROKER_URL = os.environ.get('REDIS_URL') or 'redis://localhost:6379/0'
     CELERY_RESULT_BACKEND = os.environ.get('REDIS_URL') or 'redis://localhost:6379/0'
     
+    # WebSocket配置（推送经Redis消息队列分发到各Web worker）
+    SOCKETIO_MESSAGE_QUEUE = os.environ.get('SOCKETIO_MESSAGE_QUEUE') or REDIS_URL
+    SOCKETIO_CHANNEL = os.environ.get('SOCKETIO_CHANNEL', 'visual-matrix-socketio')
+    SOCKETIO_ASYNC_MODE = os.environ.get('SOCKETIO_ASYNC_MODE', 'threading')
+    WEBSOCKET_COALESCE_WINDOW = float(os.environ.get('WEBSOCKET_COALESCE_WINDOW', 0.25))  # 进度事件合并窗口（秒）
+    WEBSOCKET_BUFFER_MAX = int(os.environ.get('WEBSOCKET_BUFFER_MAX', 50))  # 每个用户缓冲的进度事件上限，超出时丢弃最早的
+    WEBSOCKET_LOG_SAMPLE_EVERY = int(os.environ.get('WEBSOCKET_LOG_SAMPLE_EVERY', 100))  # 每N次推送记录一次DEBUG日志
+    PRESENCE_TTL = int(os.environ.get('PRESENCE_TTL', 60))  # 在线状态过期时间（秒），连接在此期间没有心跳即视为离线
+    PRESENCE_HEARTBEAT_INTERVAL = int(os.environ.get('PRESENCE_HEARTBEAT_INTERVAL', 20))  # 在线状态心跳间隔（秒）
+    TASK_EVENT_STREAM_MAXLEN = int(os.environ.get('TASK_EVENT_STREAM_MAXLEN', 500))  # 每个任务事件流保留的事件数
+    TASK_EVENT_STREAM_TTL = int(os.environ.get('TASK_EVENT_STREAM_TTL', 86400))  # 任务事件流保留时间（秒）
+    SSE_KEEPALIVE_INTERVAL = int(os.environ.get('SSE_KEEPALIVE_INTERVAL', 15))  # SSE无事件时发送保活注释的间隔（秒）
+    SSE_MAX_DURATION = int(os.environ.get('SSE_MAX_DURATION', 300))  # 单个SSE连接最长持续时间（秒），之后由客户端带Last-Event-ID重连
+    
+    # 列表分页配置
+    TASK_LIST_MAX_PER_PAGE = int(os.environ.get('TASK_LIST_MAX_PER_PAGE', 100))  # 任务列表每页最多条数
+    
     # 文件上传配置
     UPLOAD_FOLDER = os.environ.get('UPLOAD_FOLDER', 'uploads')
     PROCESSED_FOLDER = os.environ.get('PROCESSED_FOLDER', 'processed')
+    GENERATED_FOLDER = os.environ.get('GENERATED_FOLDER', 'generated')  # 生成图片本地存储目录（按内容哈希存放）
+    GENERATED_MAX_SIZE = int(os.environ.get('GENERATED_MAX_SIZE', 31457280))  # 单张生成图片最大30MB
+    GENERATED_DOWNLOAD_TIMEOUT = int(os.environ.get('GENERATED_DOWNLOAD_TIMEOUT', 60))  # 下载生成图片超时（秒）
+    THUMBNAIL_SIZE = int(os.environ.get('THUMBNAIL_SIZE', 320))  # 列表缩略图最大边长
+    PREVIEW_SIZE = int(os.environ.get('PREVIEW_SIZE', 1024))  # 预览图最大边长
+    DERIVATIVE_WEBP_QUALITY = int(os.environ.get('DERIVATIVE_WEBP_QUALITY', 80))  # 派生图WEBP质量
     MAX_CONTENT_LENGTH = int(os.environ.get('MAX_UPLOAD_SIZE', 10485760))  # 10MB default
+    UPLOAD_MAX_DIMENSION = int(os.environ.get('UPLOAD_MAX_DIMENSION', 2048))  # 上传图片最大边长，超出自动缩小
+    VISION_MAX_DIMENSION = int(os.environ.get('VISION_MAX_DIMENSION', 1536))  # 发送给视觉模型的图片最大边长
+    VISION_JPEG_QUALITY = int(os.environ.get('VISION_JPEG_QUALITY', 85))  # 发送给视觉模型的图片JPEG质量
+    
+    # 定稿渲染配置（字体、叠加素材缓存、批量定稿）
+    FONT_DIRS = os.environ.get('FONT_DIRS', '/usr/share/fonts:/usr/local/share/fonts').split(os.pathsep)
+    DEFAULT_FONT_FAMILY = os.environ.get('DEFAULT_FONT_FAMILY', 'Noto Sans CJK SC')  # 找不到字体时使用，需支持中文
+    FONT_CACHE_SIZE = int(os.environ.get('FONT_CACHE_SIZE', 64))  # 缓存的 (字体, 字号) 组合数
+    OVERLAY_CACHE_MAX_BYTES = int(os.environ.get('OVERLAY_CACHE_MAX_BYTES', 134217728))  # 每个进程LOGO等叠加素材缓存上限，默认128MB
+    FINALIZE_BATCH_MAX = int(os.environ.get('FINALIZE_BATCH_MAX', 100))  # 单次批量定稿的最大图片数
     
     # JWT配置
     JWT_SECRET_KEY = os.environ.get('JWT_SECRET_KEY') or SECRET_KEY
@@ -47,6 +81,45 @@ class Config:
     GEMINI_API_KEY = os.environ.get('GEMINI_API_KEY')
     GEMINI_BASE_URL = os.environ.get('GEMINI_BASE_URL', 'https://generativelanguage.googleapis.com')
     
+    # AI生成并发配置
+    GENERATION_MAX_PARALLEL = int(os.environ.get('GENERATION_MAX_PARALLEL', 4))  # 单个任务内并行生成的图片数
+    CHANNEL_MAX_CONCURRENCY = int(os.environ.get('CHANNEL_MAX_CONCURRENCY', 8))  # 每个worker进程内单个通道的最大并发请求数
+    MIDJOURNEY_POLL_INTERVAL = int(os.environ.get('MIDJOURNEY_POLL_INTERVAL', 5))  # Midjourney作业轮询间隔（秒）
+    MIDJOURNEY_JOB_TIMEOUT = int(os.environ.get('MIDJOURNEY_JOB_TIMEOUT', 600))  # Midjourney作业超时时间（秒）
+    MIDJOURNEY_POLL_BATCH_SIZE = int(os.environ.get('MIDJOURNEY_POLL_BATCH_SIZE', 100))  # 单次批量查询的作业数
+    
+    # AI通道HTTP连接池配置
+    HTTP_POOL_SIZE = int(os.environ.get('HTTP_POOL_SIZE', 10))  # 每个通道保持的最大连接数
+    HTTP_POOL_RETRIES = int(os.environ.get('HTTP_POOL_RETRIES', 2))  # 连接失败重试次数
+    HTTP_POOL_IDLE_TIMEOUT = int(os.environ.get('HTTP_POOL_IDLE_TIMEOUT', 300))  # 会话空闲超过该秒数后重建
+    
+    # AI通道路由配置
+    ROUTER_EWMA_ALPHA = float(os.environ.get('ROUTER_EWMA_ALPHA', 0.3))  # 延迟/错误率平滑系数
+    ROUTER_DEFAULT_LATENCY_MS = int(os.environ.get('ROUTER_DEFAULT_LATENCY_MS', 1000))  # 无观测数据时的假定延迟
+    ROUTER_ERROR_PENALTY = float(os.environ.get('ROUTER_ERROR_PENALTY', 10))  # 错误率惩罚系数
+    ROUTER_PRIORITY_WEIGHT = float(os.environ.get('ROUTER_PRIORITY_WEIGHT', 0.5))  # 优先级每低一级权重的衰减倍数
+    ROUTER_SAMPLE_WINDOW = int(os.environ.get('ROUTER_SAMPLE_WINDOW', 200))  # 延迟分位数统计的样本窗口
+    ROUTER_MIN_SAMPLES = int(os.environ.get('ROUTER_MIN_SAMPLES', 20))  # 计算分位数所需的最少样本数
+    ROUTING_TABLE_TTL = int(os.environ.get('ROUTING_TABLE_TTL', 30))  # 进程内路由表缓存时间（秒）
+    
+    # AI通道熔断配置
+    CIRCUIT_BREAKER_FAILURE_THRESHOLD = int(os.environ.get('CIRCUIT_BREAKER_FAILURE_THRESHOLD', 5))  # 窗口内失败次数阈值
+    CIRCUIT_BREAKER_WINDOW = int(os.environ.get('CIRCUIT_BREAKER_WINDOW', 60))  # 失败计数滑动窗口（秒）
+    CIRCUIT_BREAKER_COOLDOWN = int(os.environ.get('CIRCUIT_BREAKER_COOLDOWN', 30))  # 熔断后进入半开状态前的冷却时间（秒）
+    CIRCUIT_BREAKER_PROBE_TIMEOUT = int(os.environ.get('CIRCUIT_BREAKER_PROBE_TIMEOUT', 60))  # 半开试探请求的最长占用时间（秒）
+    
+    # 图片分析对冲请求配置
+    ANALYSIS_HEDGING_ENABLED = os.environ.get('ANALYSIS_HEDGING_ENABLED', 'false').lower() == 'true'
+    ANALYSIS_HEDGE_PERCENTILE = float(os.environ.get('ANALYSIS_HEDGE_PERCENTILE', 95))  # 主通道超过该延迟分位数未返回时发起对冲
+    ANALYSIS_HEDGE_DELAY_MS = int(os.environ.get('ANALYSIS_HEDGE_DELAY_MS', 8000))  # 延迟样本不足时的对冲等待时间
+    ANALYSIS_HEDGE_MIN_DELAY_MS = int(os.environ.get('ANALYSIS_HEDGE_MIN_DELAY_MS', 1000))  # 对冲等待时间下限
+    ANALYSIS_HEDGE_MAX = int(os.environ.get('ANALYSIS_HEDGE_MAX', 1))  # 单次分析最多追加的对冲请求数
+    
+    # 图片分析结果缓存配置
+    ANALYSIS_CACHE_ENABLED = os.environ.get('ANALYSIS_CACHE_ENABLED', 'true').lower() == 'true'
+    ANALYSIS_CACHE_TTL = int(os.environ.get('ANALYSIS_CACHE_TTL', 604800))  # 缓存有效期（秒），默认7天
+    ANALYSIS_CACHE_MAX_ENTRIES = int(os.environ.get('ANALYSIS_CACHE_MAX_ENTRIES', 50000))  # 最多缓存条目数，超出后淘汰最久未使用的
+    
     # 前端URL
     FRONTEND_URL = os.environ.get('FRONTEND_URL', 'http://localhost:3000')
     
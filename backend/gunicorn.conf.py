@@ -24,6 +24,8 @@ keepalive = 2
 
 # 日志配置
 accesslog = "logs/access.log"
+# 请求行只记录路径不记录查询参数（任务事件流通过 ?token= 传递JWT）
+access_log_format = '%(h)s %(l)s %(u)s %(t)s "%(m)s %(U)s %(H)s" %(s)s %(b)s "%(f)s" "%(a)s"'
 errorlog = "logs/error.log"
 loglevel = "info"
 
@@ -12,6 +12,9 @@ def init_database():
         db.create_all()
         print("数据库表创建完成")
         
+        # 升级已有数据库的表结构
+        upgrade_schema()
+        
         # 初始化系统配置
         init_system_config()
         
@@ -29,6 +32,22 @@ def init_database():
         
         print("数据库初始化完成！")
 
+def upgrade_schema():
+    """为已存在的表补充新增的列和索引（create_all不会修改已存在的表），可重复执行"""
+    inspector = db.inspect(db.engine)
+    
+    columns = {column['name'] for column in inspector.get_columns('api_models')}
+    if 'cost_per_call' not in columns:
+        with db.engine.begin() as connection:
+            connection.execute(db.text('ALTER TABLE api_models ADD COLUMN cost_per_call FLOAT'))
+        print("已为api_models添加cost_per_call列")
+    
+    indexes = {index['name'] for index in inspector.get_indexes('api_models')}
+    for index in APIModel.__table__.indexes:
+        if index.name not in indexes:
+            index.create(db.engine)
+            print(f"已为api_models创建索引 {index.name}")
+
 def init_system_config():
     """初始化系统配置"""
     configs = [
@@ -190,8 +209,8 @@ def init_api_channels():
             'api_key': 'your-openai-api-key',  # 需要替换为实际的API密钥
             'is_active': False,  # 默认不激活，需要手动配置
             'models': [
-                {'model_name': 'gpt-4-vision-preview', 'priority': 1},
-                {'model_name': 'dall-e-3', 'priority': 2}
+                {'model_name': 'gpt-4-vision-preview', 'priority': 1, 'provider': 'openai', 'capability': 'analysis'},
+                {'model_name': 'dall-e-3', 'priority': 2, 'provider': 'dalle', 'capability': 'generation'}
             ]
         },
         {
@@ -200,7 +219,7 @@ def init_api_channels():
             'api_key': 'your-gemini-api-key',  # 需要替换为实际的API密钥
             'is_active': False,
             'models': [
-                {'model_name': 'gemini-pro-vision', 'priority': 1}
+                {'model_name': 'gemini-pro-vision', 'priority': 1, 'provider': 'gemini', 'capability': 'analysis'}
             ]
         }
     ]
@@ -25,11 +25,15 @@ class User(db.Model):
 
 class AITask(db.Model):
     __tablename__ = 'ai_tasks'
+    __table_args__ = (
+        db.Index('ix_ai_tasks_user_created', 'user_id', 'created_at'),  # 用户任务列表按时间倒序分页
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     status = db.Column(db.String(20), default='pending')  # pending/analyzing/generating/completed/failed
     original_image_path = db.Column(db.String(200), nullable=False)
+    original_image_hash = db.Column(db.String(64), nullable=True, index=True)  # 原图内容SHA-256
     gemini_prompt = db.Column(db.Text, nullable=True)
     final_prompt = db.Column(db.Text, nullable=True)
     error_log = db.Column(db.Text, nullable=True)
@@ -46,12 +50,37 @@ class GeneratedResult(db.Model):
     __tablename__ = 'generated_results'
     
     id = db.Column(db.Integer, primary_key=True)
-    task_id = db.Column(db.Integer, db.ForeignKey('ai_tasks.id'), nullable=False)
-    image_url = db.Column(db.String(200), nullable=False)
+    task_id = db.Column(db.Integer, db.ForeignKey('ai_tasks.id'), nullable=False, index=True)
+    image_url = db.Column(db.String(500), nullable=False)  # 本地存储的图片URL，保存失败时为服务商URL
+    thumbnail_url = db.Column(db.String(200), nullable=True)  # 列表缩略图（WEBP）
+    preview_url = db.Column(db.String(200), nullable=True)  # 预览图（WEBP）
+    content_hash = db.Column(db.String(64), nullable=True, index=True)  # 图片内容SHA-256
+    file_size = db.Column(db.Integer, nullable=True)
+    width = db.Column(db.Integer, nullable=True)
+    height = db.Column(db.Integer, nullable=True)
     finalized_image_url = db.Column(db.String(200), nullable=True)
     editor_data_json = db.Column(db.Text, nullable=True)  # 存储编辑器数据
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+class ProviderJob(db.Model):
+    """提交到第三方（如Midjourney代理）后异步出图的生成作业"""
+    __tablename__ = 'provider_jobs'
+    __table_args__ = (
+        db.Index('ix_provider_jobs_status_channel', 'status', 'channel_id'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    task_id = db.Column(db.Integer, db.ForeignKey('ai_tasks.id'), nullable=False, index=True)
+    channel_id = db.Column(db.Integer, db.ForeignKey('api_channels.id'), nullable=False)
+    model_id = db.Column(db.Integer, db.ForeignKey('api_models.id'), nullable=True)
+    provider = db.Column(db.String(30), nullable=False)
+    external_job_id = db.Column(db.String(100), nullable=False)  # 第三方返回的任务ID
+    status = db.Column(db.String(20), default='pending')  # pending/success/failed
+    image_url = db.Column(db.String(500), nullable=True)
+    error_log = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    completed_at = db.Column(db.DateTime, nullable=True)
+
 class ProjectFolder(db.Model):
     __tablename__ = 'project_folders'
     
@@ -138,13 +167,53 @@ class APIChannel(db.Model):
     # 关系
     api_models = db.relationship('APIModel', backref='channel', lazy=True)
 
+# 服务商能力注册表 {provider: capability}
+PROVIDER_CAPABILITIES = {
+    'gemini': 'analysis',
+    'openai': 'analysis',
+    'dalle': 'generation',
+    'midjourney': 'generation',
+    'stable-diffusion': 'generation'
+}
+
 class APIModel(db.Model):
     __tablename__ = 'api_models'
+    __table_args__ = (
+        # 路由表加载：按启用/可用过滤，按优先级、单次成本排序
+        db.Index('ix_api_models_routing', 'is_active', 'is_available', 'priority', 'cost_per_call'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     channel_id = db.Column(db.Integer, db.ForeignKey('api_channels.id'), nullable=False)
     model_name = db.Column(db.String(100), nullable=False)  # 如：gpt-4, gemini-pro
     priority = db.Column(db.Integer, default=1)  # 优先级，数字越小优先级越高
+    capability = db.Column(db.String(20), nullable=True)  # analysis/generation
+    provider = db.Column(db.String(30), nullable=True)  # 服务商适配器，见PROVIDER_CAPABILITIES
+    max_concurrency = db.Column(db.Integer, nullable=True)  # 每个worker进程内的最大并发，为空时使用全局配置
+    max_batch_size = db.Column(db.Integer, nullable=True)  # 单次请求最多生成的图片数，为空时使用服务商默认值
+    cost_per_call = db.Column(db.Float, nullable=True)  # 单次调用成本，同优先级时成本低的排在前面，为空时排在最后
     is_active = db.Column(db.Boolean, default=True)
     is_available = db.Column(db.Boolean, default=True)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
\ No newline at end of file
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    @staticmethod
+    def infer_provider(model_name: str):
+        """根据模型名称推断服务商（用于未登记能力的旧数据）"""
+        name = (model_name or '').lower()
+        if 'gemini' in name:
+            return 'gemini'
+        if 'gpt' in name:
+            return 'openai'
+        if 'dall-e' in name:
+            return 'dalle'
+        if 'midjourney' in name:
+            return 'midjourney'
+        if 'stable-diffusion' in name:
+            return 'stable-diffusion'
+        return None
+    
+    def resolve_provider(self):
+        """获取模型的服务商和能力，未登记时按名称推断"""
+        provider = self.provider or self.infer_provider(self.model_name)
+        capability = self.capability or PROVIDER_CAPABILITIES.get(provider)
+        return provider, capability
\ No newline at end of file
@@ -1,8 +1,11 @@
 from flask import Blueprint, request, jsonify, current_app
 from models import (db, User, AITask, GeneratedResult, Order, SystemConfig, 
                    StyleTemplates, RechargePackages, MembershipTiers, 
-                   APIChannel, APIModel)
+                   APIChannel, APIModel, PROVIDER_CAPABILITIES)
 from utils.auth import admin_required
+from services.circuit_breaker import circuit_breaker
+from services.routing_table import routing_table
+from services.analysis_cache import analysis_cache
 from sqlalchemy import func, desc
 from datetime import datetime, timedelta
 import logging
@@ -69,7 +72,8 @@ def get_dashboard_stats(current_user):
                 'healthy_channels': healthy_channels,
                 'total_channels': total_channels,
                 'health_rate': (healthy_channels / total_channels * 100) if total_channels > 0 else 0
-            }
+            },
+            'analysis_cache': analysis_cache.stats()
         })
         
     except Exception as e:
@@ -401,15 +405,22 @@ def get_api_channels(current_user):
                 'is_healthy': channel.is_healthy,
                 'last_checked_at': channel.last_checked_at.isoformat() if channel.last_checked_at else None,
                 'latency_ms': channel.latency_ms,
+                'circuit_state': circuit_breaker.state(channel.id),
                 'created_at': channel.created_at.isoformat(),
                 'models': []
             }
             
             for model in channel.api_models:
+                provider, capability = model.resolve_provider()
                 channel_data['models'].append({
                     'id': model.id,
                     'model_name': model.model_name,
                     'priority': model.priority,
+                    'provider': provider,
+                    'capability': capability,
+                    'max_concurrency': model.max_concurrency,
+                    'max_batch_size': model.max_batch_size,
+                    'cost_per_call': model.cost_per_call,
                     'is_active': model.is_active,
                     'is_available': model.is_available
                 })
@@ -439,6 +450,7 @@ def create_api_channel(current_user):
         
         db.session.add(channel)
         db.session.commit()
+        routing_table.invalidate()
         
         logger.info(f"管理员 {current_user.username} 创建API通道: {channel.name}")
         
@@ -451,6 +463,85 @@ def create_api_channel(current_user):
         logger.error(f"创建API通道失败: {str(e)}")
         return jsonify({'error': '创建API通道失败'}), 500
 
+@admin_bp.route('/api-channels/<int:channel_id>/models', methods=['POST'])
+@admin_required
+def create_api_model(current_user, channel_id):
+    """为API通道登记模型"""
+    try:
+        channel = APIChannel.query.get(channel_id)
+        if not channel:
+            return jsonify({'error': 'API通道不存在'}), 404
+        
+        data = request.get_json()
+        model_name = data.get('model_name')
+        if not model_name:
+            return jsonify({'error': '模型名称不能为空'}), 400
+        
+        provider = data.get('provider') or APIModel.infer_provider(model_name)
+        if provider not in PROVIDER_CAPABILITIES:
+            return jsonify({'error': '不支持的服务商'}), 400
+        
+        model = APIModel(
+            channel_id=channel_id,
+            model_name=model_name,
+            priority=data.get('priority', 1),
+            provider=provider,
+            capability=PROVIDER_CAPABILITIES[provider],
+            max_concurrency=data.get('max_concurrency'),
+            max_batch_size=data.get('max_batch_size'),
+            cost_per_call=data.get('cost_per_call'),
+            is_active=data.get('is_active', True)
+        )
+        
+        db.session.add(model)
+        db.session.commit()
+        routing_table.invalidate()
+        
+        logger.info(f"管理员 {current_user.username} 为通道 {channel.name} 登记模型: {model_name}")
+        
+        return jsonify({
+            'message': '模型登记成功',
+            'model_id': model.id
+        })
+        
+    except Exception as e:
+        logger.error(f"登记模型失败: {str(e)}")
+        return jsonify({'error': '登记模型失败'}), 500
+
+@admin_bp.route('/api-models/<int:model_id>', methods=['PUT'])
+@admin_required
+def update_api_model(current_user, model_id):
+    """更新模型的优先级、能力和并发配置"""
+    try:
+        model = APIModel.query.get(model_id)
+        if not model:
+            return jsonify({'error': '模型不存在'}), 404
+        
+        data = request.get_json()
+        
+        provider = data.get('provider', model.provider)
+        if provider is not None and provider not in PROVIDER_CAPABILITIES:
+            return jsonify({'error': '不支持的服务商'}), 400
+        
+        model.provider = provider
+        model.capability = PROVIDER_CAPABILITIES.get(provider, model.capability)
+        model.priority = data.get('priority', model.priority)
+        model.max_concurrency = data.get('max_concurrency', model.max_concurrency)
+        model.max_batch_size = data.get('max_batch_size', model.max_batch_size)
+        model.cost_per_call = data.get('cost_per_call', model.cost_per_call)
+        model.is_active = data.get('is_active', model.is_active)
+        
+        db.session.commit()
+        routing_table.invalidate()
+        
+        logger.info(f"管理员 {current_user.username} 更新模型: {model.model_name}")
+        
+        return jsonify({'message': '模型更新成功'})
+        
+    except Exception as e:
+        logger.error(f"更新模型失败: {str(e)}")
+        return jsonify({'error': '更新模型失败'}), 500
+
 @admin_bp.route('/api-channels/<int:channel_id>/test', methods=['POST'])
 @admin_required
 def test_api_channel(current_user, channel_id):
@@ -481,6 +572,11 @@ def test_api_channel(current_user, channel_id):
         channel.last_checked_at = datetime.utcnow()
         
         db.session.commit()
+        routing_table.invalidate()
+        
+        # 测试通过后解除熔断
+        if is_healthy:
+            circuit_breaker.reset(channel_id)
         
         return jsonify({
             'channel_id': channel_id,
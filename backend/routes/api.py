@@ -1,9 +1,19 @@
-from flask import Blueprint, request, jsonify, current_app
+from flask import Blueprint, Response, request, jsonify, current_app
 from models import db, AITask, GeneratedResult, StyleTemplates, SystemConfig, User, ProjectFolder
-from werkzeug.utils import secure_filename
-from utils.auth import token_required
+from utils.auth import token_required, stream_token_required
 from tasks.ai_tasks import analyze_task, generate_task
-import os
+from tasks.render_tasks import (
+    finalize_task, register_render_job, get_render_job_owner, start_render_batch, get_render_batch
+)
+from config import Config
+from celery.result import AsyncResult
+from sqlalchemy.orm import joinedload, load_only, selectinload
+from services.upload_service import UploadService
+from services.event_stream import task_event_stream
+from services.presence_service import presence_registry
+import re
+import json
+import time
 import uuid
 import logging
 
@@ -35,11 +45,12 @@ def analyze_image(current_user):
         if not allowed_file(file.filename):
             return jsonify({'error': '不支持的文件格式'}), 400
         
-        # 保存上传的图片
-        filename = secure_filename(file.filename)
-        unique_filename = f"{uuid.uuid4()}_{filename}"
-        file_path = os.path.join(current_app.config['UPLOAD_FOLDER'], unique_filename)
-        file.save(file_path)
+        # 保存上传的图片（按文件头校验格式，超大图片自动缩小）
+        try:
+            upload = UploadService.save_upload(file, current_app.config['UPLOAD_FOLDER'])
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        file_path = upload['path']
         
         # 扣除分析积分
         current_user.points -= analyze_cost
@@ -48,13 +59,14 @@ def analyze_image(current_user):
         task = AITask(
             user_id=current_user.id,
             status='pending',
-            original_image_path=file_path
+            original_image_path=file_path,
+            original_image_hash=upload['content_hash']
         )
         db.session.add(task)
         db.session.commit()
         
         # 提交异步分析任务
-        analyze_task.delay(task.id, file_path, user_prompt, style_id)
+        analyze_task.delay(task.id, file_path, user_prompt, style_id, upload['content_hash'])
         
         return jsonify({
             'message': '分析任务已提交',
@@ -162,16 +174,110 @@ def get_task_status(current_user, task_id):
         result['generated_images'] = [{
             'id': r.id,
             'image_url': r.image_url,
+            'thumbnail_url': r.thumbnail_url or r.image_url,
+            'preview_url': r.preview_url or r.image_url,
             'finalized_image_url': r.finalized_image_url,
             'created_at': r.created_at.isoformat()
         } for r in results]
     
     return jsonify(result)
 
+# 收到这些事件后任务不会再有新事件，事件流随之结束
+TASK_TERMINAL_EVENTS = ('generation_complete', 'generation_failed', 'analysis_failed')
+# Redis Stream条目ID格式，即SSE的事件ID
+STREAM_EVENT_ID_PATTERN = re.compile(r'^\d+-\d+$')
+
+def _sse_message(event, data, event_id=None):
+    """格式化一条SSE消息"""
+    lines = [f"id: {event_id}"] if event_id else []
+    lines += [f"event: {event}", f"data: {data}"]
+    return '\n'.join(lines) + '\n\n'
+
+@api_bp.route('/task-status/<int:task_id>/stream', methods=['GET'])
+@stream_token_required
+def stream_task_status(current_user, task_id):
+    """
+    任务状态事件流（SSE）- 推送与WebSocket相同的任务事件，供无法使用WebSocket的客户端代替轮询
+    重连时浏览器带上Last-Event-ID，从该事件之后补发；首次连接先发送一次任务状态快照再回放已有事件
+    任务已结束且没有新事件时返回204，客户端不再重连（最终结果通过 /task-status/<task_id> 获取）
+    """
+    task = AITask.query.filter_by(id=task_id, user_id=current_user.id).first()
+    if not task:
+        return jsonify({'error': '任务不存在'}), 404
+    
+    user_id = current_user.id
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    if last_event_id and not STREAM_EVENT_ID_PATTERN.match(last_event_id):
+        return jsonify({'error': '无效的Last-Event-ID'}), 400
+    
+    try:
+        entries = task_event_stream.read(task_id, last_event_id or '0')
+    except Exception as e:
+        logger.error(f"读取任务 {task_id} 事件流失败: {str(e)}")
+        return jsonify({'error': '事件流暂不可用'}), 503
+    
+    # 任务已结束且没有待发送的事件（已收到结束事件，或事件流已过期）时返回204，EventSource收到后不再重连
+    if task.status in ('completed', 'failed') and not entries:
+        return '', 204
+    
+    snapshot = {
+        'task_id': task.id,
+        'status': task.status,
+        'quantity_requested': task.quantity_requested,
+        'quantity_succeeded': task.quantity_succeeded,
+        'error_log': task.error_log
+    }
+    
+    def generate():
+        nonlocal entries
+        session_id = f"sse:{uuid.uuid4().hex}"
+        deadline = time.monotonic() + Config.SSE_MAX_DURATION
+        cursor = last_event_id or '0'
+        
+        yield 'retry: 3000\n\n'
+        if not last_event_id:
+            yield _sse_message('task_status', json.dumps(snapshot, ensure_ascii=False))
+        
+        try:
+            presence_registry.register(user_id, session_id)
+            
+            while True:
+                for event_id, event, data in entries:
+                    yield _sse_message(event, data, event_id)
+                    cursor = event_id
+                    if event in TASK_TERMINAL_EVENTS:
+                        return
+                
+                if time.monotonic() >= deadline:
+                    return
+                
+                entries = task_event_stream.read(task_id, cursor, block_ms=Config.SSE_KEEPALIVE_INTERVAL * 1000)
+                if not entries:
+                    yield ': keep-alive\n\n'
+                    presence_registry.register(user_id, session_id)
+        
+        except Exception as e:
+            logger.error(f"任务 {task_id} 事件流中断: {str(e)}")
+        
+        finally:
+            try:
+                presence_registry.unregister(user_id, session_id)
+            except Exception as e:
+                logger.error(f"移除用户 {user_id} 在线状态失败: {str(e)}")
+    
+    return Response(
+        generate(),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'  # 禁止nginx缓冲，事件立即送达
+        }
+    )
+
 @api_bp.route('/image/finalize', methods=['POST'])
 @token_required
 def finalize_image(current_user):
-    """完成图片编辑并生成最终版本"""
+    """完成图片编辑并生成最终版本（提交到render队列异步渲染）"""
     try:
         data = request.get_json()
         result_id = data.get('result_id')
@@ -186,30 +292,98 @@ def finalize_image(current_user):
         if not result:
             return jsonify({'error': '图片不存在'}), 404
         
-        # 使用图片处理服务生成最终图片
-        from services.image_service import ImageService
-        image_service = ImageService()
-        
-        finalized_url = image_service.apply_editor_data(
-            result.image_url,
-            editor_data
-        )
-        
-        # 保存编辑数据和最终图片URL
-        result.editor_data_json = json.dumps(editor_data)
-        result.finalized_image_url = finalized_url
-        
-        db.session.commit()
+        # 渲染在独立的render队列中执行，完成后通过WebSocket推送finalize_complete
+        job_id = uuid.uuid4().hex
+        register_render_job(job_id, current_user.id)
+        finalize_task.apply_async(args=[result.id, editor_data], task_id=job_id)
         
         return jsonify({
-            'message': '图片编辑完成',
-            'finalized_image_url': finalized_url
-        })
+            'message': '图片编辑已提交',
+            'job_id': job_id,
+            'result_id': result.id,
+            'status_url': f"/api/image/finalize/{job_id}"
+        }), 202
     
     except Exception as e:
         logger.error(f"完成图片编辑失败: {str(e)}")
         return jsonify({'error': '图片编辑失败'}), 500
 
+@api_bp.route('/image/finalize/<job_id>', methods=['GET'])
+@token_required
+def get_finalize_status(current_user, job_id):
+    """查询定稿渲染作业状态（WebSocket不可用时轮询）"""
+    if get_render_job_owner(job_id) != current_user.id:
+        return jsonify({'error': '作业不存在'}), 404
+    
+    job = AsyncResult(job_id, app=finalize_task.app)
+    
+    if job.successful():
+        return jsonify({
+            'status': 'completed',
+            'finalized_image_url': job.result['finalized_image_url']
+        })
+    
+    if job.failed():
+        return jsonify({'status': 'failed', 'error': '图片编辑失败'})
+    
+    return jsonify({'status': 'pending'})
+
+@api_bp.route('/image/finalize-batch', methods=['POST'])
+@token_required
+def finalize_images_batch(current_user):
+    """用同一份编辑数据批量定稿多张图片，每完成一张通过WebSocket推送finalize_complete"""
+    try:
+        data = request.get_json()
+        editor_data = data.get('editor_data')
+        result_ids = list(dict.fromkeys(int(rid) for rid in data.get('result_ids') or []))
+        
+        if not result_ids or editor_data is None:
+            return jsonify({'error': '缺少图片或编辑数据'}), 400
+        
+        if len(result_ids) > Config.FINALIZE_BATCH_MAX:
+            return jsonify({'error': f'单次最多批量处理{Config.FINALIZE_BATCH_MAX}张图片'}), 400
+        
+        # 验证所有生成结果都属于当前用户
+        owned_ids = {
+            row.id for row in db.session.query(GeneratedResult.id).join(AITask).filter(
+                GeneratedResult.id.in_(result_ids),
+                AITask.user_id == current_user.id
+            )
+        }
+        if len(owned_ids) != len(result_ids):
+            return jsonify({'error': '图片不存在'}), 404
+        
+        batch_id = uuid.uuid4().hex
+        start_render_batch(batch_id, current_user.id, result_ids, editor_data)
+        
+        return jsonify({
+            'message': '批量编辑已提交',
+            'batch_id': batch_id,
+            'total': len(result_ids),
+            'status_url': f"/api/image/finalize-batch/{batch_id}"
+        }), 202
+    
+    except (TypeError, ValueError):
+        return jsonify({'error': '参数格式错误'}), 400
+    
+    except Exception as e:
+        logger.error(f"批量图片编辑失败: {str(e)}")
+        return jsonify({'error': '批量图片编辑失败'}), 500
+
+@api_bp.route('/image/finalize-batch/<batch_id>', methods=['GET'])
+@token_required
+def get_finalize_batch_status(current_user, batch_id):
+    """查询批量定稿进度"""
+    if get_render_job_owner(batch_id) != current_user.id:
+        return jsonify({'error': '作业不存在'}), 404
+    
+    batch = get_render_batch(batch_id)
+    if batch is None:
+        return jsonify({'error': '作业不存在'}), 404
+    
+    batch['status'] = 'completed' if batch['completed'] + batch['failed'] >= batch['total'] else 'pending'
+    return jsonify(batch)
+
 @api_bp.route('/projects', methods=['GET'])
 @token_required
 def get_user_projects(current_user):
@@ -291,11 +465,23 @@ def get_my_tasks(current_user):
     """获取当前用户的任务列表"""
     try:
         page = request.args.get('page', 1, type=int)
-        per_page = request.args.get('per_page', 20, type=int)
+        per_page = min(max(request.args.get('per_page', 20, type=int), 1), Config.TASK_LIST_MAX_PER_PAGE)
         status = request.args.get('status')
         project_id = request.args.get('project_id', type=int)
         
-        query = AITask.query.filter_by(user_id=current_user.id)
+        # 只加载列表需要的字段，项目名随任务一起JOIN查询，生成结果按本页任务ID一次查出
+        query = AITask.query.options(
+            load_only(
+                AITask.id, AITask.status, AITask.quantity_requested, AITask.quantity_succeeded,
+                AITask.total_cost_points, AITask.created_at, AITask.project_id
+            ),
+            joinedload(AITask.project_folder).load_only(ProjectFolder.name),
+            selectinload(AITask.generated_results).load_only(
+                GeneratedResult.id, GeneratedResult.task_id, GeneratedResult.image_url,
+                GeneratedResult.thumbnail_url, GeneratedResult.preview_url,
+                GeneratedResult.finalized_image_url, GeneratedResult.created_at
+            )
+        ).filter_by(user_id=current_user.id)
         
         if status:
             query = query.filter(AITask.status == status)
@@ -324,6 +510,8 @@ def get_my_tasks(current_user):
                 task_data['generated_images'].append({
                     'id': result.id,
                     'image_url': result.image_url,
+                    'thumbnail_url': result.thumbnail_url or result.image_url,
+                    'preview_url': result.preview_url or result.image_url,
                     'finalized_image_url': result.finalized_image_url,
                     'created_at': result.created_at.isoformat()
                 })
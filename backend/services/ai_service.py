@@ -1,151 +1,248 @@
-import requests
 import json
 import time
 import logging
-from models import APIChannel, APIModel, db
+import threading
+from config import Config
+from services.http_pool import HTTPSessionPool
+from services.channel_router import channel_router
+from services.circuit_breaker import circuit_breaker
+from services.routing_table import routing_table
+from services.upload_service import UploadService
+from models import APIChannel, APIModel
+from collections import namedtuple
 from typing import Optional, List
 import base64
 
 logger = logging.getLogger(__name__)
 
+# 已提交到第三方、需要后续轮询取回结果的生成作业
+PendingJob = namedtuple('PendingJob', ['channel_id', 'model_id', 'provider', 'job_id'])
+
 class AIService:
     """AI服务调度器，负责智能选择可用的API通道"""
     
+    # 服务商适配器 {provider: 调用方法名}，异步版本见AsyncAIService.PROVIDER_CALLERS
+    PROVIDER_CALLERS = {
+        'gemini': '_call_gemini_vision',
+        'openai': '_call_openai_vision',
+        'dalle': '_call_dalle',
+        'midjourney': '_call_midjourney',
+        'stable-diffusion': '_call_stable_diffusion'
+    }
+    
+    # 支持异步出图的服务商 {provider: 提交方法名}，提交后立即返回第三方任务ID
+    PROVIDER_SUBMITTERS = {
+        'midjourney': '_submit_midjourney'
+    }
+    
+    # 异步出图作业的批量查询 {provider: 查询方法名}，方法返回 {job_id: (image_url, error)}
+    PROVIDER_FETCHERS = {
+        'midjourney': 'fetch_midjourney_jobs'
+    }
+    
+    # 各服务商单次请求可生成的最大图片数，模型登记了max_batch_size时以登记值为准
+    PROVIDER_MAX_BATCH = {
+        'dalle': 10,
+        'stable-diffusion': 10,
+        'midjourney': 1
+    }
+    
+    # 各服务商视觉模型可用的最大图片边长，超出部分只会增加请求体积
+    VISION_MAX_DIMENSIONS = {
+        'gemini': Config.VISION_MAX_DIMENSION,
+        'openai': min(Config.VISION_MAX_DIMENSION, 2048)
+    }
+    
+    # 每个通道模型的并发槽位，在同一worker进程内的所有任务间共享 {(channel_id, model_id): (上限, BoundedSemaphore)}
+    _channel_slots = {}
+    _channel_slots_lock = threading.Lock()
+    
     def __init__(self):
         self.timeout = 30
         self.max_retries = 3
+        self.midjourney_poll_interval = Config.MIDJOURNEY_POLL_INTERVAL
+        self.midjourney_poll_attempts = max(1, Config.MIDJOURNEY_JOB_TIMEOUT // Config.MIDJOURNEY_POLL_INTERVAL)
     
     def get_healthy_channels(self, model_type='analysis') -> List[dict]:
-        """获取健康的API通道"""
-        channels = db.session.query(APIChannel, APIModel).join(
-            APIModel, APIChannel.id == APIModel.channel_id
-        ).filter(
-            APIChannel.is_active == True,
-            APIChannel.is_healthy == True,
-            APIModel.is_active == True,
-            APIModel.is_available == True
-        ).order_by(APIModel.priority.asc()).all()
-        
-        return [
-            {
-                'channel': channel,
-                'model': model,
-                'priority': model.priority
-            }
-            for channel, model in channels
-        ]
+        """获取健康的API通道（来自进程内路由表缓存，不查询数据库）"""
+        return routing_table.get(model_type)
     
     def analyze_image(self, image_path: str, prompt: str) -> Optional[str]:
         """
         图片分析 - 调用Gemini等视觉模型
         """
-        healthy_channels = self.get_healthy_channels('analysis')
+        # 按实时延迟、错误率和在途请求数加权排序
+        healthy_channels = channel_router.order(self.get_healthy_channels('analysis'))
         
         if not healthy_channels:
             raise Exception("没有可用的AI分析通道")
         
         for channel_info in healthy_channels:
+            channel = channel_info['channel']
+            model = channel_info['model']
+            
+            # 熔断中的通道直接跳过，半开状态下只放行一个试探请求
+            permit = circuit_breaker.allow_request(channel.id)
+            if not permit:
+                logger.info(f"通道 {channel.name} 处于熔断状态，跳过")
+                continue
+            
             try:
-                channel = channel_info['channel']
-                model = channel_info['model']
-                
                 logger.info(f"尝试使用通道 {channel.name} 的模型 {model.model_name}")
                 
-                if 'gemini' in model.model_name.lower():
-                    result = self._call_gemini_vision(channel, model, image_path, prompt)
-                elif 'gpt' in model.model_name.lower():
-                    result = self._call_openai_vision(channel, model, image_path, prompt)
-                else:
-                    continue
+                caller = self._provider_caller(model)
+                with channel_router.track(channel):
+                    result = caller(channel, model, image_path, prompt)
                 
                 if result:
+                    circuit_breaker.record_success(channel.id, permit)
                     logger.info(f"分析成功，使用了 {channel.name}/{model.model_name}")
                     return result
+                
+                # 空结果同样计为失败
+                logger.warning(f"通道 {channel.name} 返回空结果")
+                circuit_breaker.record_failure(channel.id, permit)
                     
             except Exception as e:
                 logger.warning(f"通道 {channel.name} 调用失败: {str(e)}")
-                # 标记通道为不健康
-                self._mark_channel_unhealthy(channel.id)
+                # 记录失败，由熔断器决定是否摘除通道
+                circuit_breaker.record_failure(channel.id, permit)
                 continue
+            
+            finally:
+                circuit_breaker.release(channel.id, permit)
         
         raise Exception("所有AI分析通道都不可用")
     
-    def generate_image(self, prompt: str) -> Optional[str]:
+    def generate_image(self, prompt: str, defer: bool = False):
         """
         图片生成 - 调用DALL-E、Midjourney等生成模型
+        
+        defer=True时，支持异步出图的服务商只提交作业并返回PendingJob，
+        由轮询任务取回结果，不在当前线程中等待
         """
-        healthy_channels = self.get_healthy_channels('generation')
+        return self.generate_batch(prompt, 1, defer)[0]
+    
+    def generate_batch(self, prompt: str, count: int, defer: bool = False) -> list:
+        """
+        批量图片生成 - 按通道模型的单次上限合并请求，一次调用生成多张
+        
+        返回实际生成的结果列表（图片URL或PendingJob），服务商少返回时列表可能短于count；
+        通道中途失败时，剩余数量切换到下一个通道继续生成
+        """
+        healthy_channels = channel_router.order(self.get_healthy_channels('generation'))
         
         if not healthy_channels:
             raise Exception("没有可用的AI生成通道")
         
+        results = []
         for channel_info in healthy_channels:
+            channel = channel_info['channel']
+            model = channel_info['model']
+            
+            # 熔断中的通道直接跳过，半开状态下只放行一个试探请求
+            permit = circuit_breaker.allow_request(channel.id)
+            if not permit:
+                logger.info(f"通道 {channel.name} 处于熔断状态，跳过")
+                continue
+            
             try:
-                channel = channel_info['channel']
-                model = channel_info['model']
-                
                 logger.info(f"尝试使用通道 {channel.name} 的模型 {model.model_name}")
+                produced = len(results)
                 
-                if 'dall-e' in model.model_name.lower():
-                    result = self._call_dalle(channel, model, prompt)
-                elif 'midjourney' in model.model_name.lower():
-                    result = self._call_midjourney(channel, model, prompt)
-                elif 'stable-diffusion' in model.model_name.lower():
-                    result = self._call_stable_diffusion(channel, model, prompt)
-                else:
-                    continue
+                deferred = defer and model.provider in self.PROVIDER_SUBMITTERS
+                batch_limit = 1 if deferred else self.max_batch_size(model)
                 
-                if result:
-                    logger.info(f"生成成功，使用了 {channel.name}/{model.model_name}")
-                    return result
+                for size in self.split_batches(count - len(results), batch_limit):
+                    # 限制单个通道的并发请求数，避免并行生成时压垮同一个通道
+                    with self._channel_slot(channel, model):
+                        with channel_router.track(channel):
+                            if deferred:
+                                submitter = getattr(self, self.PROVIDER_SUBMITTERS[model.provider])
+                                job_id = submitter(channel, model, prompt)
+                                images = [PendingJob(channel.id, model.id, model.provider, job_id)]
+                            else:
+                                images = self._provider_caller(model)(channel, model, prompt, size)[:size]
+                    
+                    if len(images) < size:
+                        logger.warning(f"通道 {channel.name} 请求 {size} 张，只返回了 {len(images)} 张")
+                    results.extend(images)
+                
+                if len(results) > produced:
+                    circuit_breaker.record_success(channel.id, permit)
+                    logger.info(f"生成成功，使用了 {channel.name}/{model.model_name}，共 {len(results)} 张")
+                    return results
+                
+                # 没有生成任何图片同样计为失败
+                logger.warning(f"通道 {channel.name} 没有返回图片")
+                circuit_breaker.record_failure(channel.id, permit)
                     
             except Exception as e:
                 logger.warning(f"通道 {channel.name} 调用失败: {str(e)}")
-                self._mark_channel_unhealthy(channel.id)
+                circuit_breaker.record_failure(channel.id, permit)
                 continue
+            
+            finally:
+                circuit_breaker.release(channel.id, permit)
+        
+        if results:
+            return results
         
         raise Exception("所有AI生成通道都不可用")
     
+    def max_batch_size(self, model: APIModel) -> int:
+        """获取模型单次请求可生成的最大图片数"""
+        if model.max_batch_size:
+            return model.max_batch_size
+        # DALL-E 3 每次请求只能生成一张
+        if model.provider == 'dalle' and 'dall-e-3' in model.model_name.lower():
+            return 1
+        return self.PROVIDER_MAX_BATCH.get(model.provider, 1)
+    
+    def plan_batches(self, quantity: int) -> List[int]:
+        """按首选生成通道的单次上限，把所需数量拆分为若干批"""
+        routes = self.get_healthy_channels('generation')
+        batch_limit = self.max_batch_size(routes[0]['model']) if routes else 1
+        return self.split_batches(quantity, batch_limit)
+    
+    @staticmethod
+    def split_batches(quantity: int, batch_limit: int) -> List[int]:
+        """把数量拆分为不超过上限的若干批，如 (5, 2) -> [2, 2, 1]"""
+        batch_limit = max(1, batch_limit)
+        return [min(batch_limit, quantity - start) for start in range(0, quantity, batch_limit)]
+    
+    def _session(self, channel: APIChannel):
+        """获取通道对应的复用HTTP会话"""
+        return HTTPSessionPool.get_session(channel.base_url)
+    
+    def _provider_caller(self, model: APIModel):
+        """根据模型登记的服务商获取调用方法"""
+        return getattr(self, self.PROVIDER_CALLERS[model.provider])
+    
+    @classmethod
+    def _channel_slot(cls, channel: APIChannel, model: APIModel) -> threading.BoundedSemaphore:
+        """
+        获取通道模型的并发槽位，上限取模型登记的max_concurrency
+        管理员修改上限后（路由表重新加载）换用新的槽位，仍持有旧槽位的请求结束后释放到旧槽位
+        """
+        key = (channel.id, model.id)
+        limit = model.max_concurrency or Config.CHANNEL_MAX_CONCURRENCY
+        with cls._channel_slots_lock:
+            entry = cls._channel_slots.get(key)
+            if entry is None or entry[0] != limit:
+                entry = (limit, threading.BoundedSemaphore(limit))
+                cls._channel_slots[key] = entry
+            return entry[1]
+    
     def _call_gemini_vision(self, channel: APIChannel, model: APIModel, image_path: str, prompt: str) -> str:
         """调用Gemini Vision API"""
         try:
-            # 读取并编码图片
-            with open(image_path, 'rb') as image_file:
-                image_data = base64.b64encode(image_file.read()).decode('utf-8')
-            
-            url = f"{channel.base_url}/v1/models/{model.model_name}:generateContent"
-            
-            headers = {
-                'Content-Type': 'application/json',
-                'x-goog-api-key': channel.api_key
-            }
+            url, headers, payload = self._build_gemini_vision_request(channel, model, image_path, prompt)
             
-            payload = {
-                "contents": [{
-                    "parts": [
-                        {"text": prompt},
-                        {
-                            "inline_data": {
-                                "mime_type": "image/jpeg",
-                                "data": image_data
-                            }
-                        }
-                    ]
-                }],
-                "generationConfig": {
-                    "temperature": 0.7,
-                    "maxOutputTokens": 1000
-                }
-            }
-            
-            response = requests.post(url, headers=headers, json=payload, timeout=self.timeout)
+            response = self._session(channel).post(url, headers=headers, json=payload, timeout=self.timeout)
             response.raise_for_status()
             
-            result = response.json()
-            if 'candidates' in result and len(result['candidates']) > 0:
-                return result['candidates'][0]['content']['parts'][0]['text']
-            
-            raise Exception("Gemini返回格式异常")
+            return self._parse_gemini_vision_response(response.json())
             
         except Exception as e:
             logger.error(f"Gemini调用失败: {str(e)}")
@@ -154,144 +251,64 @@ class AIService:
     def _call_openai_vision(self, channel: APIChannel, model: APIModel, image_path: str, prompt: str) -> str:
         """调用OpenAI Vision API"""
         try:
-            with open(image_path, 'rb') as image_file:
-                image_data = base64.b64encode(image_file.read()).decode('utf-8')
+            url, headers, payload = self._build_openai_vision_request(channel, model, image_path, prompt)
             
-            url = f"{channel.base_url}/v1/chat/completions"
-            
-            headers = {
-                'Content-Type': 'application/json',
-                'Authorization': f'Bearer {channel.api_key}'
-            }
-            
-            payload = {
-                "model": model.model_name,
-                "messages": [
-                    {
-                        "role": "user",
-                        "content": [
-                            {"type": "text", "text": prompt},
-                            {
-                                "type": "image_url",
-                                "image_url": {
-                                    "url": f"data:image/jpeg;base64,{image_data}"
-                                }
-                            }
-                        ]
-                    }
-                ],
-                "max_tokens": 1000
-            }
-            
-            response = requests.post(url, headers=headers, json=payload, timeout=self.timeout)
+            response = self._session(channel).post(url, headers=headers, json=payload, timeout=self.timeout)
             response.raise_for_status()
             
-            result = response.json()
-            return result['choices'][0]['message']['content']
+            return self._parse_openai_vision_response(response.json())
             
         except Exception as e:
             logger.error(f"OpenAI Vision调用失败: {str(e)}")
             raise e
     
-    def _call_dalle(self, channel: APIChannel, model: APIModel, prompt: str) -> str:
-        """调用DALL-E API"""
+    def _call_dalle(self, channel: APIChannel, model: APIModel, prompt: str, count: int = 1) -> List[str]:
+        """调用DALL-E API，一次生成count张"""
         try:
-            url = f"{channel.base_url}/v1/images/generations"
+            url, headers, payload = self._build_dalle_request(channel, model, prompt, count)
             
-            headers = {
-                'Content-Type': 'application/json',
-                'Authorization': f'Bearer {channel.api_key}'
-            }
-            
-            payload = {
-                "model": model.model_name,
-                "prompt": prompt,
-                "n": 1,
-                "size": "1024x1024",
-                "quality": "standard",
-                "response_format": "url"
-            }
-            
-            response = requests.post(url, headers=headers, json=payload, timeout=self.timeout)
+            response = self._session(channel).post(url, headers=headers, json=payload, timeout=self.timeout)
             response.raise_for_status()
             
-            result = response.json()
-            return result['data'][0]['url']
+            return self._parse_dalle_response(response.json())
             
         except Exception as e:
             logger.error(f"DALL-E调用失败: {str(e)}")
             raise e
     
-    def _call_stable_diffusion(self, channel: APIChannel, model: APIModel, prompt: str) -> str:
-        """调用Stable Diffusion API"""
+    def _call_stable_diffusion(self, channel: APIChannel, model: APIModel, prompt: str, count: int = 1) -> List[str]:
+        """调用Stable Diffusion API，一次生成count张"""
         try:
-            url = f"{channel.base_url}/v1/generation/text-to-image"
-            
-            headers = {
-                'Content-Type': 'application/json',
-                'Authorization': f'Bearer {channel.api_key}'
-            }
-            
-            payload = {
-                "text_prompts": [{"text": prompt}],
-                "cfg_scale": 7,
-                "height": 1024,
-                "width": 1024,
-                "samples": 1,
-                "steps": 30
-            }
+            url, headers, payload = self._build_stable_diffusion_request(channel, model, prompt, count)
             
-            response = requests.post(url, headers=headers, json=payload, timeout=self.timeout)
+            response = self._session(channel).post(url, headers=headers, json=payload, timeout=self.timeout)
             response.raise_for_status()
             
-            result = response.json()
-            # 这里需要根据实际API响应格式调整
-            return result['artifacts'][0]['base64']  # 或者是URL
+            return self._parse_stable_diffusion_response(response.json())
             
         except Exception as e:
             logger.error(f"Stable Diffusion调用失败: {str(e)}")
             raise e
     
-    def _call_midjourney(self, channel: APIChannel, model: APIModel, prompt: str) -> str:
-        """调用Midjourney API（第三方代理）"""
+    def _call_midjourney(self, channel: APIChannel, model: APIModel, prompt: str, count: int = 1) -> List[str]:
+        """调用Midjourney API（第三方代理），同步等待出图，每次只生成一张"""
         try:
-            url = f"{channel.base_url}/submit/imagine"
-            
-            headers = {
-                'Content-Type': 'application/json',
-                'Authorization': f'Bearer {channel.api_key}'
-            }
-            
-            payload = {
-                "prompt": prompt,
-                "base64Array": []
-            }
+            _, headers, _ = self._build_midjourney_request(channel, model, prompt)
             
             # 提交任务
-            response = requests.post(url, headers=headers, json=payload, timeout=self.timeout)
-            response.raise_for_status()
-            
-            task_result = response.json()
-            task_id = task_result.get('result')
-            
-            if not task_id:
-                raise Exception("Midjourney任务提交失败")
+            task_id = self._submit_midjourney(channel, model, prompt)
             
             # 轮询结果
-            for _ in range(60):  # 最多等待5分钟
-                time.sleep(5)
+            for _ in range(self.midjourney_poll_attempts):
+                time.sleep(self.midjourney_poll_interval)
                 
                 fetch_url = f"{channel.base_url}/task/{task_id}/fetch"
-                fetch_response = requests.get(fetch_url, headers=headers, timeout=self.timeout)
+                fetch_response = self._session(channel).get(fetch_url, headers=headers, timeout=self.timeout)
                 fetch_response.raise_for_status()
                 
-                fetch_result = fetch_response.json()
-                status = fetch_result.get('status')
-                
-                if status == 'SUCCESS':
-                    return fetch_result.get('imageUrl')
-                elif status == 'FAILURE':
-                    raise Exception("Midjourney生成失败")
+                image_url = self._parse_midjourney_fetch_response(fetch_response.json())
+                if image_url:
+                    return [image_url]
             
             raise Exception("Midjourney生成超时")
             
@@ -299,12 +316,216 @@ class AIService:
             logger.error(f"Midjourney调用失败: {str(e)}")
             raise e
     
-    def _mark_channel_unhealthy(self, channel_id: int):
-        """标记通道为不健康"""
-        try:
-            channel = APIChannel.query.get(channel_id)
-            if channel:
-                channel.is_healthy = False
-                db.session.commit()
-        except Exception as e:
-            logger.error(f"标记通道不健康失败: {str(e)}")
\ No newline at end of file
+    def _submit_midjourney(self, channel: APIChannel, model: APIModel, prompt: str) -> str:
+        """提交Midjourney作业，返回第三方任务ID"""
+        url, headers, payload = self._build_midjourney_request(channel, model, prompt)
+        
+        response = self._session(channel).post(url, headers=headers, json=payload, timeout=self.timeout)
+        response.raise_for_status()
+        
+        return self._parse_midjourney_submit_response(response.json())
+    
+    def fetch_provider_jobs(self, channel: APIChannel, provider: str, job_ids: List[str]) -> dict:
+        """
+        按服务商批量查询同一通道上的异步出图作业
+        返回 {job_id: (image_url, error)}，两者都为None表示仍在进行中；未返回的作业不在结果中
+        """
+        fetcher = self.PROVIDER_FETCHERS.get(provider)
+        if fetcher is None:
+            raise ValueError(f"服务商 {provider} 不支持作业查询")
+        return getattr(self, fetcher)(channel, job_ids)
+    
+    def fetch_midjourney_jobs(self, channel: APIChannel, job_ids: List[str]) -> dict:
+        """
+        批量查询同一通道上的Midjourney作业状态
+        返回 {job_id: (image_url, error)}，两者都为None表示仍在进行中；未返回的作业不在结果中
+        """
+        headers = {
+            'Content-Type': 'application/json',
+            'Authorization': f'Bearer {channel.api_key}'
+        }
+        url = f"{channel.base_url}/task/list-by-condition"
+        
+        statuses = {}
+        for start in range(0, len(job_ids), Config.MIDJOURNEY_POLL_BATCH_SIZE):
+            batch = job_ids[start:start + Config.MIDJOURNEY_POLL_BATCH_SIZE]
+            
+            response = self._session(channel).post(url, headers=headers, json={'ids': batch}, timeout=self.timeout)
+            response.raise_for_status()
+            
+            for result in response.json():
+                try:
+                    statuses[result.get('id')] = (self._parse_midjourney_fetch_response(result), None)
+                except Exception as e:
+                    statuses[result.get('id')] = (None, str(e))
+        
+        return statuses
+    
+    # ============ 请求构建与响应解析（同步/异步调用共用） ============
+    def _read_vision_image(self, image_path: str, provider: str) -> tuple:
+        """读取预处理（缩小、重新编码）后的图片，返回 (base64数据, mime类型)"""
+        max_dimension = self.VISION_MAX_DIMENSIONS.get(provider, Config.VISION_MAX_DIMENSION)
+        image_bytes, mime_type = UploadService.prepare_for_vision(image_path, max_dimension)
+        return base64.b64encode(image_bytes).decode('utf-8'), mime_type
+    
+    def _build_gemini_vision_request(self, channel: APIChannel, model: APIModel, image_path: str, prompt: str) -> tuple:
+        """构建Gemini Vision请求"""
+        image_data, mime_type = self._read_vision_image(image_path, 'gemini')
+        
+        url = f"{channel.base_url}/v1/models/{model.model_name}:generateContent"
+        
+        headers = {
+            'Content-Type': 'application/json',
+            'x-goog-api-key': channel.api_key
+        }
+        
+        payload = {
+            "contents": [{
+                "parts": [
+                    {"text": prompt},
+                    {
+                        "inline_data": {
+                            "mime_type": mime_type,
+                            "data": image_data
+                        }
+                    }
+                ]
+            }],
+            "generationConfig": {
+                "temperature": 0.7,
+                "maxOutputTokens": 1000
+            }
+        }
+        
+        return url, headers, payload
+    
+    def _parse_gemini_vision_response(self, result: dict) -> str:
+        """解析Gemini Vision响应"""
+        if 'candidates' in result and len(result['candidates']) > 0:
+            return result['candidates'][0]['content']['parts'][0]['text']
+        
+        raise Exception("Gemini返回格式异常")
+    
+    def _build_openai_vision_request(self, channel: APIChannel, model: APIModel, image_path: str, prompt: str) -> tuple:
+        """构建OpenAI Vision请求"""
+        image_data, mime_type = self._read_vision_image(image_path, 'openai')
+        
+        url = f"{channel.base_url}/v1/chat/completions"
+        
+        headers = {
+            'Content-Type': 'application/json',
+            'Authorization': f'Bearer {channel.api_key}'
+        }
+        
+        payload = {
+            "model": model.model_name,
+            "messages": [
+                {
+                    "role": "user",
+                    "content": [
+                        {"type": "text", "text": prompt},
+                        {
+                            "type": "image_url",
+                            "image_url": {
+                                "url": f"data:{mime_type};base64,{image_data}"
+                            }
+                        }
+                    ]
+                }
+            ],
+            "max_tokens": 1000
+        }
+        
+        return url, headers, payload
+    
+    def _parse_openai_vision_response(self, result: dict) -> str:
+        """解析OpenAI Vision响应"""
+        return result['choices'][0]['message']['content']
+    
+    def _build_dalle_request(self, channel: APIChannel, model: APIModel, prompt: str, count: int = 1) -> tuple:
+        """构建DALL-E请求"""
+        url = f"{channel.base_url}/v1/images/generations"
+        
+        headers = {
+            'Content-Type': 'application/json',
+            'Authorization': f'Bearer {channel.api_key}'
+        }
+        
+        payload = {
+            "model": model.model_name,
+            "prompt": prompt,
+            "n": count,
+            "size": "1024x1024",
+            "quality": "standard",
+            "response_format": "url"
+        }
+        
+        return url, headers, payload
+    
+    def _parse_dalle_response(self, result: dict) -> List[str]:
+        """解析DALL-E响应"""
+        return [item['url'] for item in result['data'] if item.get('url')]
+    
+    def _build_stable_diffusion_request(self, channel: APIChannel, model: APIModel, prompt: str, count: int = 1) -> tuple:
+        """构建Stable Diffusion请求"""
+        url = f"{channel.base_url}/v1/generation/text-to-image"
+        
+        headers = {
+            'Content-Type': 'application/json',
+            'Authorization': f'Bearer {channel.api_key}'
+        }
+        
+        payload = {
+            "text_prompts": [{"text": prompt}],
+            "cfg_scale": 7,
+            "height": 1024,
+            "width": 1024,
+            "samples": count,
+            "steps": 30
+        }
+        
+        return url, headers, payload
+    
+    def _parse_stable_diffusion_response(self, result: dict) -> List[str]:
+        """解析Stable Diffusion响应"""
+        # 这里需要根据实际API响应格式调整，被内容过滤的样本不返回图片
+        return [
+            artifact['base64'] for artifact in result['artifacts']
+            if artifact.get('base64') and artifact.get('finishReason') != 'CONTENT_FILTERED'
+        ]  # 或者是URL
+    
+    def _build_midjourney_request(self, channel: APIChannel, model: APIModel, prompt: str) -> tuple:
+        """构建Midjourney提交请求"""
+        url = f"{channel.base_url}/submit/imagine"
+        
+        headers = {
+            'Content-Type': 'application/json',
+            'Authorization': f'Bearer {channel.api_key}'
+        }
+        
+        payload = {
+            "prompt": prompt,
+            "base64Array": []
+        }
+        
+        return url, headers, payload
+    
+    def _parse_midjourney_submit_response(self, result: dict) -> str:
+        """解析Midjourney提交响应，返回第三方任务ID"""
+        task_id = result.get('result')
+        
+        if not task_id:
+            raise Exception("Midjourney任务提交失败")
+        
+        return task_id
+    
+    def _parse_midjourney_fetch_response(self, result: dict) -> Optional[str]:
+        """解析Midjourney任务状态，完成时返回图片URL，未完成返回None"""
+        status = result.get('status')
+        
+        if status == 'SUCCESS':
+            return result.get('imageUrl')
+        elif status == 'FAILURE':
+            raise Exception("Midjourney生成失败")
+        
+        return None
\ No newline at end of file
@@ -0,0 +1,118 @@
+from config import Config
+from utils.redis_client import get_redis
+from typing import Optional
+import hashlib
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+class AnalysisCache:
+    """
+    图片分析结果缓存 - 以图片内容哈希 + 规范化提示词为键
+    
+    同一张商品图搭配相同需求/风格重复上传时直接返回历史分析结果。
+    条目带TTL，并通过有序集合记录最近访问时间，超过容量上限时淘汰最久未使用的条目。
+    访问时间早于TTL窗口的成员对应的条目必然已过期，统计和淘汰前先从有序集合中清除。
+    Redis不可用时视为未命中，不影响正常分析。
+    """
+    
+    KEY_PREFIX = 'vm:analysis_cache'
+    
+    @staticmethod
+    def normalize_prompt(prompt: str) -> str:
+        """规范化提示词：合并空白字符、统一大小写"""
+        return ' '.join((prompt or '').split()).lower()
+    
+    def make_key(self, image_hash: str, prompt: str) -> str:
+        """根据图片哈希和提示词生成缓存键"""
+        prompt_hash = hashlib.sha256(self.normalize_prompt(prompt).encode('utf-8')).hexdigest()
+        return f"{image_hash}:{prompt_hash[:32]}"
+    
+    def get(self, key: str) -> Optional[str]:
+        """读取缓存，命中时刷新访问时间"""
+        if not Config.ANALYSIS_CACHE_ENABLED:
+            return None
+        
+        try:
+            client = get_redis()
+            value = client.get(self._entry_key(key))
+            
+            pipe = client.pipeline()
+            if value is not None:
+                pipe.zadd(self._index_key(), {key: time.time()})
+                pipe.incr(self._stat_key('hits'))
+            else:
+                # 条目已过期时一并移除其访问记录
+                pipe.zrem(self._index_key(), key)
+                pipe.incr(self._stat_key('misses'))
+            pipe.execute()
+            
+            return value.decode('utf-8') if value is not None else None
+        
+        except Exception as e:
+            logger.warning(f"读取分析缓存失败: {str(e)}")
+            return None
+    
+    def set(self, key: str, value: str):
+        """写入缓存，超过容量时淘汰最久未使用的条目"""
+        if not Config.ANALYSIS_CACHE_ENABLED or not value:
+            return
+        
+        try:
+            client = get_redis()
+            pipe = client.pipeline()
+            pipe.set(self._entry_key(key), value, ex=Config.ANALYSIS_CACHE_TTL)
+            pipe.zadd(self._index_key(), {key: time.time()})
+            self._prune_expired(pipe)
+            pipe.zcard(self._index_key())
+            size = pipe.execute()[-1]
+            
+            overflow = size - Config.ANALYSIS_CACHE_MAX_ENTRIES
+            if overflow > 0:
+                evicted = client.zpopmin(self._index_key(), overflow)
+                if evicted:
+                    client.delete(*[self._entry_key(member.decode('utf-8')) for member, _ in evicted])
+        
+        except Exception as e:
+            logger.warning(f"写入分析缓存失败: {str(e)}")
+    
+    def stats(self) -> dict:
+        """获取缓存命中统计"""
+        try:
+            pipe = get_redis().pipeline()
+            pipe.get(self._stat_key('hits'))
+            pipe.get(self._stat_key('misses'))
+            self._prune_expired(pipe)
+            pipe.zcard(self._index_key())
+            hits, misses, _, size = pipe.execute()
+            
+            hits = int(hits or 0)
+            misses = int(misses or 0)
+            total = hits + misses
+            return {
+                'hits': hits,
+                'misses': misses,
+                'hit_rate': (hits / total * 100) if total > 0 else 0,
+                'size': size
+            }
+        
+        except Exception as e:
+            logger.warning(f"读取分析缓存统计失败: {str(e)}")
+            return {'hits': 0, 'misses': 0, 'hit_rate': 0, 'size': 0}
+    
+    def _prune_expired(self, pipe):
+        """清除访问时间早于TTL窗口的成员（条目写入不晚于最近访问，这些条目已随TTL过期）"""
+        pipe.zremrangebyscore(self._index_key(), '-inf', time.time() - Config.ANALYSIS_CACHE_TTL)
+    
+    def _entry_key(self, key: str) -> str:
+        return f"{self.KEY_PREFIX}:entry:{key}"
+    
+    def _index_key(self) -> str:
+        return f"{self.KEY_PREFIX}:lru"
+    
+    def _stat_key(self, name: str) -> str:
+        return f"{self.KEY_PREFIX}:stats:{name}"
+
+# 进程内共享的分析缓存实例
+analysis_cache = AnalysisCache()
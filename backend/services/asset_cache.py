@@ -0,0 +1,79 @@
+from config import Config
+from PIL import Image
+from collections import OrderedDict
+from typing import Callable, Hashable
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+class OverlayCache:
+    """
+    叠加素材（LOGO等）的进程内缓存 - 保存解码后的原图和按尺寸、透明度处理好的结果，
+    按图片占用的内存字节数做LRU淘汰，批量定稿使用同一个LOGO时只下载和缩放一次
+    """
+    
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # {key: (image, size_bytes)}
+        self._bytes = 0
+        self._hits = 0
+        self._misses = 0
+    
+    def get_or_create(self, key: Hashable, factory: Callable[[], Image.Image]) -> Image.Image:
+        """获取缓存的图片，不存在时调用factory生成并缓存（返回的图片不可修改）"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return entry[0]
+            self._misses += 1
+        
+        image = factory()
+        image.load()
+        size_bytes = self._image_bytes(image)
+        
+        # 超过总容量的大图不缓存，避免把其他素材全部挤出
+        if size_bytes > self.max_bytes:
+            return image
+        
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = (image, size_bytes)
+                self._bytes += size_bytes
+                self._evict()
+        return image
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+    
+    def stats(self) -> dict:
+        """缓存命中统计"""
+        with self._lock:
+            total = self._hits + self._misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_rate': (self._hits / total * 100) if total > 0 else 0
+            }
+    
+    def _evict(self):
+        """淘汰最久未使用的条目，直到占用不超过上限"""
+        while self._bytes > self.max_bytes and self._entries:
+            _, (_, size_bytes) = self._entries.popitem(last=False)
+            self._bytes -= size_bytes
+    
+    @staticmethod
+    def _image_bytes(image: Image.Image) -> int:
+        """估算解码后图片占用的内存"""
+        return image.width * image.height * len(image.getbands())
+
+# 进程内共享的叠加素材缓存
+overlay_cache = OverlayCache(Config.OVERLAY_CACHE_MAX_BYTES)
@@ -0,0 +1,392 @@
+import aiohttp
+import asyncio
+import logging
+from config import Config
+from models import APIChannel, APIModel
+from services.ai_service import AIService
+from services.channel_router import channel_router
+from services.circuit_breaker import circuit_breaker
+from typing import Optional, List
+
+logger = logging.getLogger(__name__)
+
+class AsyncAIService(AIService):
+    """
+    AI服务的异步版本 - 在一个事件循环中同时维持大量进行中的通道请求和轮询
+    
+    用法：
+        async with AsyncAIService() as ai_service:
+            urls = await ai_service.generate_images(prompt, 4)
+    
+    同步代码（如Celery任务）中可以通过 asyncio.run() 驱动。
+    请求构建、响应解析和通道选择逻辑与同步版本共用；其中会阻塞的部分（路由表加载、
+    熔断器读写Redis、读取和缩放图片）放到线程中执行，不阻塞事件循环中的其他请求。
+    """
+    
+    # 服务商适配器 {provider: 协程方法名}，与同步版本的方法分开命名，继承的同步调用不受影响
+    PROVIDER_CALLERS = {
+        'gemini': '_acall_gemini_vision',
+        'openai': '_acall_openai_vision',
+        'dalle': '_acall_dalle',
+        'midjourney': '_acall_midjourney',
+        'stable-diffusion': '_acall_stable_diffusion'
+    }
+    
+    def __init__(self):
+        super().__init__()
+        self._sessions = {}  # {base_url: aiohttp.ClientSession}
+        self._slots = {}  # {(channel_id, model_id): (上限, asyncio.Semaphore)}
+        self._routing_lock = asyncio.Lock()
+    
+    async def __aenter__(self):
+        return self
+    
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+    
+    async def close(self):
+        """关闭所有HTTP会话"""
+        for session in self._sessions.values():
+            await session.close()
+        self._sessions.clear()
+    
+    async def _healthy_channels(self, model_type: str) -> List[dict]:
+        """
+        在线程中获取可用通道（路由表过期时会查询数据库）
+        同一实例内串行执行，避免多个线程同时使用应用上下文中的同一个数据库会话
+        """
+        async with self._routing_lock:
+            return await asyncio.to_thread(self.get_healthy_channels, model_type)
+    
+    async def analyze_image(self, image_path: str, prompt: str) -> Optional[str]:
+        """
+        图片分析 - 异步调用Gemini等视觉模型
+        """
+        # 按实时延迟、错误率和在途请求数加权排序
+        healthy_channels = channel_router.order(await self._healthy_channels('analysis'))
+        
+        if not healthy_channels:
+            raise Exception("没有可用的AI分析通道")
+        
+        for channel_info in healthy_channels:
+            channel = channel_info['channel']
+            model = channel_info['model']
+            
+            # 熔断中的通道直接跳过，半开状态下只放行一个试探请求
+            permit = await asyncio.to_thread(circuit_breaker.allow_request, channel.id)
+            if not permit:
+                logger.info(f"通道 {channel.name} 处于熔断状态，跳过")
+                continue
+            
+            try:
+                logger.info(f"尝试使用通道 {channel.name} 的模型 {model.model_name}")
+                
+                caller = self._provider_caller(model)
+                with channel_router.track(channel):
+                    result = await caller(channel, model, image_path, prompt)
+                
+                if result:
+                    await asyncio.to_thread(circuit_breaker.record_success, channel.id, permit)
+                    logger.info(f"分析成功，使用了 {channel.name}/{model.model_name}")
+                    return result
+                
+                # 空结果同样计为失败
+                logger.warning(f"通道 {channel.name} 返回空结果")
+                await asyncio.to_thread(circuit_breaker.record_failure, channel.id, permit)
+            
+            except Exception as e:
+                logger.warning(f"通道 {channel.name} 调用失败: {str(e)}")
+                await asyncio.to_thread(circuit_breaker.record_failure, channel.id, permit)
+                continue
+            
+            finally:
+                # 被取消等未记录结果时释放试探位
+                await asyncio.to_thread(circuit_breaker.release, channel.id, permit)
+        
+        raise Exception("所有AI分析通道都不可用")
+    
+    async def analyze_image_hedged(self, image_path: str, prompt: str) -> Optional[str]:
+        """
+        对冲图片分析 - 主通道在其历史延迟分位数内未返回时，向下一个通道发起相同请求，
+        采用最先返回的结果并取消其余请求
+        """
+        healthy_channels = channel_router.order(await self._healthy_channels('analysis'))
+        
+        if not healthy_channels:
+            raise Exception("没有可用的AI分析通道")
+        
+        candidates = iter(healthy_channels)
+        in_flight = {}  # {asyncio.Task: channel_info}
+        hedges = 0
+        
+        async def launch_next() -> Optional[dict]:
+            for channel_info in candidates:
+                channel = channel_info['channel']
+                permit = await asyncio.to_thread(circuit_breaker.allow_request, channel.id)
+                if not permit:
+                    logger.info(f"通道 {channel.name} 处于熔断状态，跳过")
+                    continue
+                
+                task = asyncio.ensure_future(self._analyze_with_channel(
+                    channel, channel_info['model'], image_path, prompt, permit
+                ))
+                in_flight[task] = channel_info
+                return channel_info
+            return None
+        
+        try:
+            while True:
+                # 没有进行中的请求（首次或前一个请求失败）时，按顺序切换到下一个通道
+                if not in_flight and await launch_next() is None:
+                    break
+                
+                # 仍可对冲时，等待时间为最早发出的请求所在通道的延迟分位数
+                timeout = None
+                if hedges < Config.ANALYSIS_HEDGE_MAX:
+                    primary = next(iter(in_flight.values()))['channel']
+                    timeout = self._hedge_delay(primary.id)
+                
+                done, _ = await asyncio.wait(
+                    list(in_flight), timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+                )
+                
+                if not done:
+                    # 超过对冲阈值仍未返回，向下一个通道发出相同请求
+                    channel_info = await launch_next()
+                    if channel_info is not None:
+                        hedges += 1
+                        logger.info(f"分析请求超过对冲阈值，追加通道 {channel_info['channel'].name}")
+                    else:
+                        hedges = Config.ANALYSIS_HEDGE_MAX
+                    continue
+                
+                for task in done:
+                    in_flight.pop(task)
+                    if task.exception() is None:
+                        return task.result()
+        
+        finally:
+            # 取消仍在进行中的请求，落败通道已等待的时间由路由器按删失延迟计入
+            for task in in_flight:
+                task.cancel()
+            if in_flight:
+                await asyncio.gather(*in_flight, return_exceptions=True)
+        
+        raise Exception("所有AI分析通道都不可用")
+    
+    async def _analyze_with_channel(self, channel: APIChannel, model: APIModel, image_path: str, prompt: str,
+                                    permit: str = None) -> str:
+        """在指定通道上执行一次分析，结果计入路由统计和熔断器（permit为allow_request返回的许可）"""
+        try:
+            logger.info(f"尝试使用通道 {channel.name} 的模型 {model.model_name}")
+            
+            caller = self._provider_caller(model)
+            with channel_router.track(channel):
+                result = await caller(channel, model, image_path, prompt)
+            
+            if not result:
+                raise Exception("AI分析返回空结果")
+            
+            await asyncio.to_thread(circuit_breaker.record_success, channel.id, permit)
+            logger.info(f"分析成功，使用了 {channel.name}/{model.model_name}")
+            return result
+        
+        except Exception as e:
+            logger.warning(f"通道 {channel.name} 调用失败: {str(e)}")
+            await asyncio.to_thread(circuit_breaker.record_failure, channel.id, permit)
+            raise e
+        
+        finally:
+            # 对冲中被取消的试探请求释放试探位
+            await asyncio.to_thread(circuit_breaker.release, channel.id, permit)
+    
+    def _hedge_delay(self, channel_id: int) -> float:
+        """获取对冲等待时间（秒），样本不足时使用默认值"""
+        latency_ms = channel_router.latency_percentile(channel_id, Config.ANALYSIS_HEDGE_PERCENTILE)
+        if latency_ms is None:
+            latency_ms = Config.ANALYSIS_HEDGE_DELAY_MS
+        return max(latency_ms, Config.ANALYSIS_HEDGE_MIN_DELAY_MS) / 1000.0
+    
+    async def generate_image(self, prompt: str) -> Optional[str]:
+        """
+        图片生成 - 异步调用DALL-E、Midjourney等生成模型
+        """
+        return (await self.generate_batch(prompt, 1))[0]
+    
+    async def generate_batch(self, prompt: str, count: int) -> List[str]:
+        """
+        批量图片生成 - 按通道模型的单次上限合并请求，通道中途失败时剩余数量切换到下一个通道
+        """
+        healthy_channels = channel_router.order(await self._healthy_channels('generation'))
+        
+        if not healthy_channels:
+            raise Exception("没有可用的AI生成通道")
+        
+        results = []
+        for channel_info in healthy_channels:
+            channel = channel_info['channel']
+            model = channel_info['model']
+            
+            # 熔断中的通道直接跳过，半开状态下只放行一个试探请求
+            permit = await asyncio.to_thread(circuit_breaker.allow_request, channel.id)
+            if not permit:
+                logger.info(f"通道 {channel.name} 处于熔断状态，跳过")
+                continue
+            
+            try:
+                logger.info(f"尝试使用通道 {channel.name} 的模型 {model.model_name}")
+                
+                caller = self._provider_caller(model)
+                produced = len(results)
+                for size in self.split_batches(count - len(results), self.max_batch_size(model)):
+                    async with self._channel_slot_async(channel, model):
+                        with channel_router.track(channel):
+                            results.extend(await caller(channel, model, prompt, size))
+                
+                if len(results) > produced:
+                    await asyncio.to_thread(circuit_breaker.record_success, channel.id, permit)
+                    logger.info(f"生成成功，使用了 {channel.name}/{model.model_name}，共 {len(results)} 张")
+                    return results
+                
+                # 没有生成任何图片同样计为失败
+                logger.warning(f"通道 {channel.name} 没有返回图片")
+                await asyncio.to_thread(circuit_breaker.record_failure, channel.id, permit)
+            
+            except Exception as e:
+                logger.warning(f"通道 {channel.name} 调用失败: {str(e)}")
+                await asyncio.to_thread(circuit_breaker.record_failure, channel.id, permit)
+                continue
+            
+            finally:
+                # 被取消等未记录结果时释放试探位
+                await asyncio.to_thread(circuit_breaker.release, channel.id, permit)
+        
+        if results:
+            return results
+        
+        raise Exception("所有AI生成通道都不可用")
+    
+    async def generate_images(self, prompt: str, quantity: int) -> List[Optional[str]]:
+        """并发生成多张图片（按批合并请求），失败或缺少的位置返回None"""
+        async with self._routing_lock:
+            batches = await asyncio.to_thread(self.plan_batches, quantity)
+        results = await asyncio.gather(
+            *(self.generate_batch(prompt, size) for size in batches),
+            return_exceptions=True
+        )
+        
+        images = []
+        for size, result in zip(batches, results):
+            if isinstance(result, Exception):
+                logger.error(f"生成 {size} 张图片的批次失败: {str(result)}")
+                result = []
+            images.extend(result[:size])
+            images.extend([None] * (size - len(result[:size])))
+        return images
+    
+    def _channel_slot_async(self, channel: APIChannel, model: APIModel) -> asyncio.Semaphore:
+        """获取通道模型的异步并发槽位"""
+        key = (channel.id, model.id)
+        limit = model.max_concurrency or Config.CHANNEL_MAX_CONCURRENCY
+        entry = self._slots.get(key)
+        if entry is None or entry[0] != limit:
+            entry = (limit, asyncio.Semaphore(limit))
+            self._slots[key] = entry
+        return entry[1]
+    
+    def _async_session(self, channel: APIChannel) -> aiohttp.ClientSession:
+        """获取通道对应的复用异步HTTP会话"""
+        key = channel.base_url.rstrip('/')
+        session = self._sessions.get(key)
+        if session is None or session.closed:
+            connector = aiohttp.TCPConnector(
+                limit_per_host=Config.HTTP_POOL_SIZE,
+                keepalive_timeout=Config.HTTP_POOL_IDLE_TIMEOUT
+            )
+            session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.timeout)
+            )
+            self._sessions[key] = session
+        return session
+    
+    async def _request_json(self, channel: APIChannel, method: str, url: str, **kwargs) -> dict:
+        """发送请求并返回JSON结果"""
+        async with self._async_session(channel).request(method, url, **kwargs) as response:
+            response.raise_for_status()
+            return await response.json(content_type=None)
+    
+    async def _acall_gemini_vision(self, channel: APIChannel, model: APIModel, image_path: str, prompt: str) -> str:
+        """异步调用Gemini Vision API"""
+        try:
+            # 读取和缩放图片在线程中执行
+            url, headers, payload = await asyncio.to_thread(
+                self._build_gemini_vision_request, channel, model, image_path, prompt
+            )
+            result = await self._request_json(channel, 'POST', url, headers=headers, json=payload)
+            return self._parse_gemini_vision_response(result)
+        
+        except Exception as e:
+            logger.error(f"Gemini调用失败: {str(e)}")
+            raise e
+    
+    async def _acall_openai_vision(self, channel: APIChannel, model: APIModel, image_path: str, prompt: str) -> str:
+        """异步调用OpenAI Vision API"""
+        try:
+            url, headers, payload = await asyncio.to_thread(
+                self._build_openai_vision_request, channel, model, image_path, prompt
+            )
+            result = await self._request_json(channel, 'POST', url, headers=headers, json=payload)
+            return self._parse_openai_vision_response(result)
+        
+        except Exception as e:
+            logger.error(f"OpenAI Vision调用失败: {str(e)}")
+            raise e
+    
+    async def _acall_dalle(self, channel: APIChannel, model: APIModel, prompt: str, count: int = 1) -> List[str]:
+        """异步调用DALL-E API，一次生成count张"""
+        try:
+            url, headers, payload = self._build_dalle_request(channel, model, prompt, count)
+            result = await self._request_json(channel, 'POST', url, headers=headers, json=payload)
+            return self._parse_dalle_response(result)
+        
+        except Exception as e:
+            logger.error(f"DALL-E调用失败: {str(e)}")
+            raise e
+    
+    async def _acall_stable_diffusion(self, channel: APIChannel, model: APIModel, prompt: str, count: int = 1) -> List[str]:
+        """异步调用Stable Diffusion API，一次生成count张"""
+        try:
+            url, headers, payload = self._build_stable_diffusion_request(channel, model, prompt, count)
+            result = await self._request_json(channel, 'POST', url, headers=headers, json=payload)
+            return self._parse_stable_diffusion_response(result)
+        
+        except Exception as e:
+            logger.error(f"Stable Diffusion调用失败: {str(e)}")
+            raise e
+    
+    async def _acall_midjourney(self, channel: APIChannel, model: APIModel, prompt: str, count: int = 1) -> List[str]:
+        """异步调用Midjourney API，轮询期间不占用线程，每次只生成一张"""
+        try:
+            url, headers, payload = self._build_midjourney_request(channel, model, prompt)
+            
+            # 提交任务
+            result = await self._request_json(channel, 'POST', url, headers=headers, json=payload)
+            task_id = self._parse_midjourney_submit_response(result)
+            
+            # 轮询结果
+            for _ in range(self.midjourney_poll_attempts):
+                await asyncio.sleep(self.midjourney_poll_interval)
+                
+                fetch_url = f"{channel.base_url}/task/{task_id}/fetch"
+                fetch_result = await self._request_json(channel, 'GET', fetch_url, headers=headers)
+                
+                image_url = self._parse_midjourney_fetch_response(fetch_result)
+                if image_url:
+                    return [image_url]
+            
+            raise Exception("Midjourney生成超时")
+        
+        except Exception as e:
+            logger.error(f"Midjourney调用失败: {str(e)}")
+            raise e
@@ -0,0 +1,141 @@
+from config import Config
+from contextlib import contextmanager
+from collections import deque
+from typing import List, Optional
+import threading
+import random
+import math
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+class ChannelRouter:
+    """
+    通道路由器 - 根据实时延迟、错误率和在途请求数对候选通道加权排序
+    
+    每个通道的代价 = 平滑延迟 × (1 + 在途请求数) × (1 + 错误率 × 惩罚系数)，
+    权重为代价的倒数，并按优先级逐级衰减。排序使用加权随机抽样，
+    使负载分散到同等的通道上，慢通道和出错的通道被自动降权。
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}  # {channel_id: {'latency_ms', 'error_rate', 'outstanding', 'samples'}}
+    
+    def order(self, candidates: List[dict]) -> List[dict]:
+        """对候选通道（get_healthy_channels的返回值）按路由权重排序"""
+        if len(candidates) <= 1:
+            return list(candidates)
+        
+        min_priority = min(c['priority'] for c in candidates)
+        
+        keyed = []
+        for candidate in candidates:
+            weight = self._weight(candidate['channel'], candidate['priority'] - min_priority)
+            # Efraimidis-Spirakis加权无放回抽样（对数形式，避免权重很小时下溢）
+            keyed.append((math.log(1.0 - random.random()) / weight, candidate))
+        
+        keyed.sort(key=lambda item: item[0], reverse=True)
+        return [candidate for _, candidate in keyed]
+    
+    @contextmanager
+    def track(self, channel):
+        """记录一次通道调用的在途状态、耗时和结果"""
+        stats = self._get_stats(channel)
+        with self._lock:
+            stats['outstanding'] += 1
+        
+        start_time = time.time()
+        success = None
+        try:
+            yield
+            success = True
+        except Exception:
+            success = False
+            raise
+        finally:
+            latency = int((time.time() - start_time) * 1000)
+            with self._lock:
+                stats['outstanding'] -= 1
+            if success is None:
+                # 被取消的请求（如对冲请求中落败的一方）没有结果，已等待的时间按删失样本计入延迟
+                self.record_censored(channel, latency)
+            else:
+                self.record(channel, latency, success)
+    
+    def record(self, channel, latency_ms: int, success: bool):
+        """记录一次调用的延迟和结果，更新平滑统计"""
+        stats = self._get_stats(channel)
+        alpha = Config.ROUTER_EWMA_ALPHA
+        
+        with self._lock:
+            stats['error_rate'] = (1 - alpha) * stats['error_rate'] + alpha * (0.0 if success else 1.0)
+            # 失败请求的耗时通常是超时时间，不计入延迟统计
+            if success:
+                stats['latency_ms'] = (1 - alpha) * stats['latency_ms'] + alpha * latency_ms
+                stats['samples'].append(latency_ms)
+    
+    def record_censored(self, channel, latency_ms: int):
+        """
+        记录一次未返回就被取消的调用 - 真实延迟不低于已等待的时间，按不低于当前平滑延迟的值计入，
+        挂起的通道因此逐步降权，不会凭旧的低延迟一直排在首位
+        """
+        stats = self._get_stats(channel)
+        alpha = Config.ROUTER_EWMA_ALPHA
+        
+        with self._lock:
+            observed = max(latency_ms, stats['latency_ms'])
+            stats['latency_ms'] = (1 - alpha) * stats['latency_ms'] + alpha * observed
+            stats['samples'].append(int(observed))
+    
+    def latency_percentile(self, channel_id: int, percentile: float) -> Optional[float]:
+        """获取通道观测延迟的分位数，样本不足时返回None"""
+        with self._lock:
+            stats = self._stats.get(channel_id)
+            if not stats or len(stats['samples']) < Config.ROUTER_MIN_SAMPLES:
+                return None
+            samples = sorted(stats['samples'])
+        
+        index = min(len(samples) - 1, int(len(samples) * percentile / 100))
+        return samples[index]
+    
+    def snapshot(self) -> dict:
+        """获取所有通道当前的路由统计"""
+        with self._lock:
+            return {
+                channel_id: {
+                    'latency_ms': int(stats['latency_ms']),
+                    'error_rate': round(stats['error_rate'], 3),
+                    'outstanding': stats['outstanding']
+                }
+                for channel_id, stats in self._stats.items()
+            }
+    
+    def _weight(self, channel, priority_offset: int) -> float:
+        """计算通道的路由权重"""
+        stats = self._get_stats(channel)
+        with self._lock:
+            cost = (
+                max(stats['latency_ms'], 1.0)
+                * (1 + stats['outstanding'])
+                * (1 + stats['error_rate'] * Config.ROUTER_ERROR_PENALTY)
+            )
+        return (Config.ROUTER_PRIORITY_WEIGHT ** priority_offset) / cost
+    
+    def _get_stats(self, channel) -> dict:
+        """获取通道统计，首次出现时使用健康检查记录的延迟作为初始值"""
+        with self._lock:
+            stats = self._stats.get(channel.id)
+            if stats is None:
+                stats = {
+                    'latency_ms': float(channel.latency_ms or Config.ROUTER_DEFAULT_LATENCY_MS),
+                    'error_rate': 0.0,
+                    'outstanding': 0,
+                    'samples': deque(maxlen=Config.ROUTER_SAMPLE_WINDOW)
+                }
+                self._stats[channel.id] = stats
+            return stats
+
+# 进程内共享的路由器实例
+channel_router = ChannelRouter()
@@ -0,0 +1,168 @@
+from config import Config
+from utils.redis_client import get_redis
+from typing import Optional
+import time
+import uuid
+import logging
+
+logger = logging.getLogger(__name__)
+
+class CircuitBreaker:
+    """
+    API通道熔断器 - 状态保存在Redis中，所有worker共享
+    
+    closed: 正常放行，滑动窗口内失败次数达到阈值后进入open
+    open: 拒绝请求，冷却时间过后进入half_open
+    half_open: 只放行一个试探请求，成功则恢复closed，失败则重新open
+    
+    allow_request返回的许可需要传回record_success/record_failure/release，
+    只有持有试探令牌的请求能关闭或重新打开熔断，熔断前发出的请求迟到的结果不影响状态。
+    Redis不可用时默认放行，不影响正常调用。
+    """
+    
+    KEY_PREFIX = 'vm:circuit'
+    
+    # 熔断关闭时的普通许可
+    PASS = 'pass'
+    
+    # 试探令牌匹配时关闭熔断 KEYS: probe, opened_at, failures
+    _CLOSE_SCRIPT = """
+        if redis.call('GET', KEYS[1]) == ARGV[1] then
+            redis.call('DEL', KEYS[1], KEYS[2], KEYS[3])
+            return 1
+        end
+        return 0
+    """
+    # 试探令牌匹配时重新开始冷却 KEYS: probe, opened_at  ARGV: 令牌, 当前时间
+    _REOPEN_SCRIPT = """
+        if redis.call('GET', KEYS[1]) == ARGV[1] then
+            redis.call('SET', KEYS[2], ARGV[2])
+            redis.call('DEL', KEYS[1])
+            return 1
+        end
+        return 0
+    """
+    # 试探令牌匹配时释放试探位 KEYS: probe
+    _RELEASE_SCRIPT = """
+        if redis.call('GET', KEYS[1]) == ARGV[1] then
+            return redis.call('DEL', KEYS[1])
+        end
+        return 0
+    """
+    
+    def allow_request(self, channel_id: int) -> Optional[str]:
+        """
+        判断是否允许向通道发送请求，不允许时返回None
+        允许时返回许可：熔断关闭时为PASS，半开状态下为本次试探的令牌
+        """
+        try:
+            client = get_redis()
+            opened_at = client.get(self._key(channel_id, 'opened_at'))
+            if opened_at is None:
+                return self.PASS
+            
+            if time.time() - float(opened_at) < Config.CIRCUIT_BREAKER_COOLDOWN:
+                return None
+            
+            # 半开状态：同一时间只允许一个试探请求
+            token = uuid.uuid4().hex
+            if client.set(self._key(channel_id, 'probe'), token, nx=True, ex=Config.CIRCUIT_BREAKER_PROBE_TIMEOUT):
+                return token
+            return None
+        
+        except Exception as e:
+            logger.warning(f"读取通道 {channel_id} 熔断状态失败: {str(e)}")
+            return self.PASS
+    
+    def record_success(self, channel_id: int, permit: Optional[str] = None):
+        """记录一次成功调用，只有半开状态的试探请求成功时关闭熔断"""
+        if not self._is_probe(permit):
+            return
+        
+        try:
+            closed = get_redis().eval(
+                self._CLOSE_SCRIPT, 3,
+                self._key(channel_id, 'probe'), self._key(channel_id, 'opened_at'), self._key(channel_id, 'failures'),
+                permit
+            )
+            if closed:
+                logger.info(f"通道 {channel_id} 熔断恢复")
+        
+        except Exception as e:
+            logger.warning(f"记录通道 {channel_id} 成功状态失败: {str(e)}")
+    
+    def release(self, channel_id: int, permit: Optional[str]):
+        """
+        结束一次调用，试探请求既没有记录成功也没有记录失败时（被跳过、取消等）释放试探位，
+        避免整个通道在试探超时前一直被拒绝；已记录结果或普通许可时无操作
+        """
+        if not self._is_probe(permit):
+            return
+        
+        try:
+            get_redis().eval(self._RELEASE_SCRIPT, 1, self._key(channel_id, 'probe'), permit)
+        except Exception as e:
+            logger.warning(f"释放通道 {channel_id} 试探位失败: {str(e)}")
+    
+    def record_failure(self, channel_id: int, permit: Optional[str] = None):
+        """记录一次失败调用，达到阈值或半开试探失败时打开熔断"""
+        try:
+            client = get_redis()
+            now = time.time()
+            failures_key = self._key(channel_id, 'failures')
+            opened_key = self._key(channel_id, 'opened_at')
+            
+            pipe = client.pipeline()
+            pipe.zadd(failures_key, {f"{now}:{uuid.uuid4().hex[:8]}": now})
+            pipe.zremrangebyscore(failures_key, 0, now - Config.CIRCUIT_BREAKER_WINDOW)
+            pipe.zcard(failures_key)
+            pipe.expire(failures_key, Config.CIRCUIT_BREAKER_WINDOW)
+            pipe.get(opened_key)
+            _, _, failure_count, _, opened_at = pipe.execute()
+            
+            if opened_at is not None:
+                # 半开试探失败，重新开始冷却；熔断前发出的请求迟到的失败只计数
+                if self._is_probe(permit) and client.eval(
+                    self._REOPEN_SCRIPT, 2, self._key(channel_id, 'probe'), opened_key, permit, now
+                ):
+                    logger.warning(f"通道 {channel_id} 试探失败，继续熔断")
+            elif failure_count >= Config.CIRCUIT_BREAKER_FAILURE_THRESHOLD:
+                if client.set(opened_key, now, nx=True):
+                    logger.warning(f"通道 {channel_id} 在 {Config.CIRCUIT_BREAKER_WINDOW} 秒内失败 {failure_count} 次，触发熔断")
+        
+        except Exception as e:
+            logger.warning(f"记录通道 {channel_id} 失败状态失败: {str(e)}")
+    
+    def state(self, channel_id: int) -> str:
+        """获取通道当前熔断状态: closed/open/half_open/unknown"""
+        try:
+            opened_at = get_redis().get(self._key(channel_id, 'opened_at'))
+            if opened_at is None:
+                return 'closed'
+            if time.time() - float(opened_at) < Config.CIRCUIT_BREAKER_COOLDOWN:
+                return 'open'
+            return 'half_open'
+        
+        except Exception as e:
+            logger.warning(f"读取通道 {channel_id} 熔断状态失败: {str(e)}")
+            return 'unknown'
+    
+    def reset(self, channel_id: int):
+        """重置通道熔断状态"""
+        try:
+            get_redis().delete(
+                self._key(channel_id, 'opened_at'),
+                self._key(channel_id, 'failures'),
+                self._key(channel_id, 'probe')
+            )
+        except Exception as e:
+            logger.warning(f"重置通道 {channel_id} 熔断状态失败: {str(e)}")
+    
+    def _is_probe(self, permit: Optional[str]) -> bool:
+        return bool(permit) and permit != self.PASS
+    
+    def _key(self, channel_id: int, name: str) -> str:
+        return f"{self.KEY_PREFIX}:{channel_id}:{name}"
+
+# 进程内共享的熔断器实例
+circuit_breaker = CircuitBreaker()
@@ -0,0 +1,51 @@
+from config import Config
+from utils.redis_client import get_redis, get_pubsub_redis
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 每个任务的事件流，条目为 {event, data}，条目ID即SSE的事件ID
+TASK_EVENT_STREAM_KEY = 'vm:task:{task_id}:events'
+
+class TaskEventStream:
+    """
+    任务事件流 - 推送给用户的任务事件同时追加到Redis Stream，
+    SSE连接按事件ID续读，断线重连后从Last-Event-ID之后补发，不需要再查询数据库
+    """
+    
+    def publish(self, task_id: int, event: str, data: dict):
+        """追加一条任务事件"""
+        key = TASK_EVENT_STREAM_KEY.format(task_id=task_id)
+        pipe = get_redis().pipeline(transaction=False)
+        pipe.xadd(
+            key,
+            {'event': event, 'data': json.dumps(data, ensure_ascii=False)},
+            maxlen=Config.TASK_EVENT_STREAM_MAXLEN,
+            approximate=True
+        )
+        pipe.expire(key, Config.TASK_EVENT_STREAM_TTL)
+        pipe.execute()
+    
+    def read(self, task_id: int, last_id: str = '0', block_ms: int = None) -> list:
+        """
+        读取last_id之后的事件，返回 [(事件ID, 事件名, 数据JSON)]
+        block_ms不为空时最多阻塞等待这么久，阻塞读取使用不设读超时的连接
+        """
+        key = TASK_EVENT_STREAM_KEY.format(task_id=task_id)
+        if block_ms is None:
+            response = get_redis().xread({key: last_id})
+        else:
+            response = get_pubsub_redis().xread({key: last_id}, block=block_ms)
+        
+        if not response:
+            return []
+        
+        _, entries = response[0]
+        return [
+            (entry_id.decode(), fields[b'event'].decode(), fields[b'data'].decode())
+            for entry_id, fields in entries
+        ]
+
+# 进程内共享的任务事件流
+task_event_stream = TaskEventStream()
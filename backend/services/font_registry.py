@@ -0,0 +1,118 @@
+from config import Config
+from PIL import ImageFont
+from functools import lru_cache
+from typing import Optional
+import threading
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+FONT_EXTENSIONS = ('.ttf', '.ttc', '.otf')
+
+# 编辑器中常用字体在Linux上的替代字体，按顺序查找
+FONT_ALIASES = {
+    'arial': ['Liberation Sans', 'DejaVu Sans'],
+    'helvetica': ['Liberation Sans', 'DejaVu Sans'],
+    'times new roman': ['Liberation Serif', 'DejaVu Serif'],
+    'simhei': ['Noto Sans CJK SC', 'WenQuanYi Zen Hei', 'Droid Sans Fallback'],  # 黑体
+    'simsun': ['Noto Serif CJK SC', 'AR PL UMing CN', 'Noto Sans CJK SC'],  # 宋体
+    'microsoft yahei': ['Noto Sans CJK SC', 'WenQuanYi Micro Hei'],
+}
+
+class FontRegistry:
+    """
+    进程内字体注册表 - 首次使用时扫描字体目录建立 字体族 -> 文件 的索引，
+    按 (字体族, 字号) 缓存已加载的字体对象，同一画布上的多个文字不再重复解析字体文件
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._index = None  # {规范化的字体族或文件名: (字体文件路径, 字体集合中的序号)}
+        self._load_font = lru_cache(maxsize=Config.FONT_CACHE_SIZE)(self._load_font_uncached)
+    
+    def get_font(self, family: str, size: int):
+        """获取字体对象，找不到对应字体时依次使用替代字体、默认字体和内置位图字体"""
+        return self._load_font(self._normalize(family), int(size))
+    
+    def find_font(self, family: str) -> Optional[tuple]:
+        """查找字体族对应的 (字体文件, 序号)，.ttc字体集合中的字体通过序号区分"""
+        index = self._get_index()
+        name = self._normalize(family)
+        
+        for candidate in [name] + [self._normalize(alias) for alias in FONT_ALIASES.get(name, [])]:
+            if candidate in index:
+                return index[candidate]
+        return None
+    
+    def cache_info(self):
+        """字体缓存命中统计"""
+        return self._load_font.cache_info()
+    
+    def _load_font_uncached(self, family: str, size: int):
+        font = self.find_font(family) or self.find_font(Config.DEFAULT_FONT_FAMILY)
+        
+        if font:
+            font_path, face_index = font
+            try:
+                return ImageFont.truetype(font_path, size, index=face_index)
+            except OSError as e:
+                logger.warning(f"加载字体 {font_path}#{face_index} 失败: {str(e)}")
+        
+        logger.warning(f"未找到字体 {family}，使用内置默认字体")
+        return ImageFont.load_default()
+    
+    def _get_index(self) -> dict:
+        if self._index is None:
+            with self._lock:
+                if self._index is None:
+                    self._index = self._scan()
+        return self._index
+    
+    def _scan(self) -> dict:
+        """扫描字体目录，按文件名和字体族名建立索引（常规字重优先）"""
+        index = {}
+        regular = set()
+        
+        for font_dir in Config.FONT_DIRS:
+            for root, _, files in os.walk(font_dir):
+                for filename in sorted(files):
+                    if not filename.lower().endswith(FONT_EXTENSIONS):
+                        continue
+                    
+                    font_path = os.path.join(root, filename)
+                    index.setdefault(self._normalize(os.path.splitext(filename)[0]), (font_path, 0))
+                    
+                    for face_index, family, style in self._faces(font_path):
+                        key = self._normalize(family)
+                        is_regular = (style or '').lower() in ('regular', 'book', 'normal', 'roman')
+                        if key not in index or (is_regular and key not in regular):
+                            index[key] = (font_path, face_index)
+                            if is_regular:
+                                regular.add(key)
+        
+        logger.info(f"字体目录扫描完成，共索引 {len(index)} 个字体名称")
+        return index
+    
+    @staticmethod
+    def _faces(font_path: str) -> list:
+        """
+        列出字体文件中的所有字体 [(序号, 字体族, 样式)]
+        .ttc字体集合包含多个字体（如NotoSansCJK的JP/KR/SC/TC），逐个序号读取直到不存在
+        """
+        faces = []
+        max_faces = 64 if font_path.lower().endswith('.ttc') else 1
+        for face_index in range(max_faces):
+            try:
+                family, style = ImageFont.truetype(font_path, 12, index=face_index).getname()
+            except OSError:
+                break
+            faces.append((face_index, family, style))
+        return faces
+    
+    @staticmethod
+    def _normalize(name: str) -> str:
+        return ' '.join((name or '').replace('-', ' ').replace('_', ' ').lower().split())
+
+# 进程内共享的字体注册表
+font_registry = FontRegistry()
@@ -0,0 +1,91 @@
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from config import Config
+import threading
+import time
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+class HTTPSessionPool:
+    """按通道base_url复用的HTTP连接池，在同一worker进程内的所有任务间共享"""
+    
+    _sessions = {}  # {base_url: (session, last_used_at)}
+    _lock = threading.Lock()
+    _pid = None
+    _hits = 0
+    _misses = 0
+    
+    @classmethod
+    def get_session(cls, base_url: str) -> requests.Session:
+        """获取指定通道的会话，不存在或空闲过久时新建"""
+        key = base_url.rstrip('/')
+        now = time.time()
+        
+        with cls._lock:
+            # fork出的子进程不能复用父进程的socket
+            if cls._pid != os.getpid():
+                cls._sessions = {}
+                cls._pid = os.getpid()
+            
+            entry = cls._sessions.get(key)
+            if entry and now - entry[1] < Config.HTTP_POOL_IDLE_TIMEOUT:
+                cls._hits += 1
+                cls._sessions[key] = (entry[0], now)
+                return entry[0]
+            
+            # 空闲超时的连接大概率已被服务端关闭，换用新会话；旧会话可能仍被其他线程使用，
+            # 不主动关闭，没有引用后由垃圾回收释放连接
+            cls._misses += 1
+            session = cls._create_session()
+            cls._sessions[key] = (session, now)
+            logger.info(f"为通道 {key} 创建HTTP连接池")
+            return session
+    
+    @classmethod
+    def _create_session(cls) -> requests.Session:
+        """创建带连接池和重试策略的会话"""
+        # 只重试连接阶段的错误和幂等请求，避免生成类POST请求被重复提交
+        retry = Retry(
+            total=Config.HTTP_POOL_RETRIES,
+            connect=Config.HTTP_POOL_RETRIES,
+            read=0,
+            status=Config.HTTP_POOL_RETRIES,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=frozenset(['GET', 'HEAD']),
+            backoff_factor=0.5,
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=Config.HTTP_POOL_SIZE,
+            max_retries=retry
+        )
+        
+        session = requests.Session()
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        session.headers.update({'Connection': 'keep-alive'})
+        return session
+    
+    @classmethod
+    def stats(cls) -> dict:
+        """获取连接池命中统计"""
+        with cls._lock:
+            total = cls._hits + cls._misses
+            return {
+                'sessions': len(cls._sessions),
+                'hits': cls._hits,
+                'misses': cls._misses,
+                'hit_rate': (cls._hits / total * 100) if total > 0 else 0
+            }
+    
+    @classmethod
+    def close_all(cls):
+        """关闭所有会话（worker子进程退出时由celery_app调用）"""
+        with cls._lock:
+            for session, _ in cls._sessions.values():
+                session.close()
+            cls._sessions.clear()
@@ -1,15 +1,28 @@
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image, ImageColor, ImageDraw
 import requests
+import hashlib
+import math
+import base64
 import io
 import json
 import os
+import re
 import uuid
 import logging
 from typing import Dict, Any, Optional
 from werkzeug.utils import secure_filename
+from services.storage_service import StorageService
+from services.font_registry import font_registry
+from services.asset_cache import overlay_cache
 
 logger = logging.getLogger(__name__)
 
+# Fabric.js对象原点在宽/高方向上的相对位置
+FABRIC_ORIGINS = {'left': 0.0, 'top': 0.0, 'center': 0.5, 'right': 1.0, 'bottom': 1.0}
+
+# rgb()/rgba()颜色，alpha为0~1的小数（ImageColor只接受整数alpha）
+RGBA_COLOR_PATTERN = re.compile(r'^rgba?\(\s*([\d.]+)\s*,\s*([\d.]+)\s*,\s*([\d.]+)\s*(?:,\s*([\d.]+)\s*)?\)$')
+
 class ImageService:
     """图片处理服务 - 负责图片的后期处理和合成"""
     
@@ -26,8 +39,8 @@ class ImageService:
         根据编辑器数据在基础图片上添加文字、LOGO等元素
         """
         try:
-            # 下载基础图片
-            base_image = self._download_image(base_image_url)
+            # 下载基础图片，保留透明通道
+            base_image = self._download_image(base_image_url, mode='RGBA')
             
             # 解析编辑器数据并应用到图片上
             final_image = self._apply_fabric_data(base_image, editor_data)
@@ -41,10 +54,17 @@ class ImageService:
             logger.error(f"应用编辑数据失败: {str(e)}")
             raise e
     
-    def _download_image(self, image_url: str) -> Image.Image:
-        """下载图片并转换为PIL Image对象"""
+    def _download_image(self, image_url: str, mode: str = 'RGB') -> Image.Image:
+        """下载图片并转换为指定模式的PIL Image对象"""
         try:
-            if image_url.startswith('http'):
+            # 已保存到本地存储的图片直接读取文件，不再经过网络
+            local_path = StorageService.local_path(image_url)
+            if local_path:
+                image_data = local_path
+            elif image_url.startswith('data:'):
+                # 编辑器中从本地添加的素材以data URI形式内嵌
+                image_data = io.BytesIO(base64.b64decode(image_url.split(',', 1)[-1]))
+            elif image_url.startswith('http'):
                 response = requests.get(image_url, timeout=30)
                 response.raise_for_status()
                 image_data = io.BytesIO(response.content)
@@ -54,9 +74,8 @@ class ImageService:
             
             image = Image.open(image_data)
             
-            # 确保图片是RGB模式
-            if image.mode != 'RGB':
-                image = image.convert('RGB')
+            if image.mode != mode:
+                image = image.convert(mode)
             
             return image
         
@@ -66,27 +85,33 @@ class ImageService:
     
     def _apply_fabric_data(self, base_image: Image.Image, editor_data: Dict[str, Any]) -> Image.Image:
         """
-        根据Fabric.js编辑器数据在图片上添加元素
+        根据Fabric.js编辑器数据在图片上添加元素（在RGBA画布上合成）
         """
         try:
             # 创建一个可编辑的图片副本
-            result_image = base_image.copy()
-            draw = ImageDraw.Draw(result_image)
+            # 文字和形状都先画在各自的透明图层上再按alpha合成，半透明颜色不会覆盖画布的透明度
+            result_image = base_image.convert('RGBA') if base_image.mode != 'RGBA' else base_image.copy()
+            
+            # 编辑器画布按背景图缩放显示，对象坐标需要换算回原图像素
+            canvas_scale = self._canvas_scale(editor_data)
             
             # 获取画布对象列表
             objects = editor_data.get('objects', [])
             
             for obj in objects:
+                if obj.get('visible') is False:
+                    continue
+                
                 obj_type = obj.get('type', '')
                 
                 if obj_type == 'textbox' or obj_type == 'text':
-                    self._add_text_to_image(draw, result_image, obj)
+                    self._add_text_to_image(result_image, obj, canvas_scale)
                 elif obj_type == 'image':
-                    self._add_image_to_image(result_image, obj)
+                    self._add_image_to_image(result_image, obj, canvas_scale)
                 elif obj_type == 'rect':
-                    self._add_rectangle_to_image(draw, obj)
+                    self._add_rectangle_to_image(result_image, obj, canvas_scale)
                 elif obj_type == 'circle':
-                    self._add_circle_to_image(draw, obj)
+                    self._add_circle_to_image(result_image, obj, canvas_scale)
             
             return result_image
         
@@ -94,160 +119,262 @@ class ImageService:
             logger.error(f"应用Fabric数据失败: {str(e)}")
             raise e
     
-    def _add_text_to_image(self, draw: ImageDraw.Draw, image: Image.Image, text_obj: Dict[str, Any]):
-        """在图片上添加文字"""
+    def _canvas_scale(self, editor_data: Dict[str, Any]) -> tuple:
+        """编辑器画布坐标到原图像素的缩放比例（背景图缩放的倒数）"""
+        background = editor_data.get('backgroundImage') or {}
+        scale_x = float(background.get('scaleX') or 1)
+        scale_y = float(background.get('scaleY') or 1)
+        return 1 / scale_x, 1 / scale_y
+    
+    def _object_box(self, obj: Dict[str, Any], canvas_scale: tuple) -> tuple:
+        """
+        计算Fabric对象在原图中的 (宽, 高, 中心x, 中心y, 旋转角度)
+        left/top是originX/originY所指的点，对象绕该点旋转angle度（顺时针）
+        """
+        width = float(obj.get('width', 0)) * abs(float(obj.get('scaleX', 1))) * canvas_scale[0]
+        height = float(obj.get('height', 0)) * abs(float(obj.get('scaleY', 1))) * canvas_scale[1]
+        left = float(obj.get('left', 0)) * canvas_scale[0]
+        top = float(obj.get('top', 0)) * canvas_scale[1]
+        angle = float(obj.get('angle', 0)) % 360
+        
+        # 原点到中心的偏移，按旋转角度转换到画布坐标
+        dx = (0.5 - FABRIC_ORIGINS.get(obj.get('originX', 'left'), 0.0)) * width
+        dy = (0.5 - FABRIC_ORIGINS.get(obj.get('originY', 'top'), 0.0)) * height
+        radians = math.radians(angle)
+        center_x = left + dx * math.cos(radians) - dy * math.sin(radians)
+        center_y = top + dx * math.sin(radians) + dy * math.cos(radians)
+        
+        return width, height, center_x, center_y, angle
+    
+    def _stroke_width(self, obj: Dict[str, Any], canvas_scale: tuple) -> int:
+        """
+        描边宽度换算到原图像素：与几何尺寸一样乘以对象的scaleX/scaleY和画布比例，
+        strokeUniform为真时描边不随对象缩放，只按画布比例换算；两个方向比例不同时取几何平均
+        """
+        scale_x, scale_y = canvas_scale
+        if not obj.get('strokeUniform'):
+            scale_x *= abs(float(obj.get('scaleX', 1)))
+            scale_y *= abs(float(obj.get('scaleY', 1)))
+        return max(0, int(round(float(obj.get('strokeWidth', 1)) * math.sqrt(scale_x * scale_y))))
+    
+    def _parse_color(self, color: Optional[str]):
+        """转换Fabric颜色（#hex、rgb()、rgba()、颜色名）为RGBA元组，透明或无效时返回None"""
+        if not color or color == 'transparent':
+            return None
+        try:
+            match = RGBA_COLOR_PATTERN.match(color.replace(' ', ''))
+            if match:
+                red, green, blue = (min(255, int(round(float(c)))) for c in match.group(1, 2, 3))
+                alpha = float(match.group(4)) if match.group(4) is not None else 1.0
+                rgba = (red, green, blue, int(round(min(max(alpha, 0.0), 1.0) * 255)))
+            else:
+                rgba = ImageColor.getrgb(color)
+                if len(rgba) == 3:
+                    rgba = rgba + (255,)
+        except ValueError:
+            return None
+        
+        return rgba if rgba[3] > 0 else None
+    
+    def _new_layer(self, width: float, height: float, padding: int, color: tuple) -> Image.Image:
+        """
+        创建对象的透明图层（对象外接框四周各留padding像素）
+        图层底色取绘制颜色、alpha为0，抗锯齿边缘只改变alpha，合成后不会出现暗边
+        """
+        size = (max(1, int(math.ceil(width)) + padding * 2), max(1, int(math.ceil(height)) + padding * 2))
+        return Image.new('RGBA', size, color[:3] + (0,))
+    
+    def _transform_layer(self, layer: Image.Image, angle: float = 0, opacity: float = 1.0,
+                         flip_x: bool = False, flip_y: bool = False) -> Image.Image:
+        """
+        按Fabric变换处理对象图层：翻转、绕图层中心旋转、整体透明度
+        Pillow对RGBA的旋转内部按预乘透明度计算，透明边缘不会出现黑边
+        """
+        if flip_x:
+            layer = layer.transpose(Image.Transpose.FLIP_LEFT_RIGHT)
+        if flip_y:
+            layer = layer.transpose(Image.Transpose.FLIP_TOP_BOTTOM)
+        
+        # Fabric角度为顺时针，Pillow为逆时针
+        if angle:
+            layer = layer.rotate(-angle, resample=Image.Resampling.BICUBIC, expand=True)
+        
+        # 透明度通过查找表作用于alpha通道
+        if opacity < 1.0:
+            alpha = layer.getchannel('A').point([int(round(i * opacity)) for i in range(256)])
+            layer.putalpha(alpha)
+        
+        return layer
+    
+    def _composite_centered(self, base_image: Image.Image, layer: Image.Image, center_x: float, center_y: float):
+        """把图层中心对齐到对象中心合成到画布上"""
+        left = int(round(center_x - layer.width / 2))
+        top = int(round(center_y - layer.height / 2))
+        self._composite(base_image, layer, left, top)
+    
+    def _add_text_to_image(self, image: Image.Image, text_obj: Dict[str, Any], canvas_scale: tuple = (1, 1)):
+        """在图片上添加文字，支持旋转、翻转和透明度"""
         try:
             text = text_obj.get('text', '')
-            left = int(text_obj.get('left', 0))
-            top = int(text_obj.get('top', 0))
-            font_size = int(text_obj.get('fontSize', 20))
-            fill_color = text_obj.get('fill', '#000000')
+            width, height, center_x, center_y, angle = self._object_box(text_obj, canvas_scale)
+            font_size = max(1, int(round(
+                float(text_obj.get('fontSize', 20)) * abs(float(text_obj.get('scaleY', 1))) * canvas_scale[1]
+            )))
+            fill_color = self._parse_color(text_obj.get('fill', '#000000'))
+            stroke_color = self._parse_color(text_obj.get('stroke'))
+            stroke_width = self._stroke_width(text_obj, canvas_scale) if stroke_color is not None else 0
             font_family = text_obj.get('fontFamily', 'Arial')
+            opacity = float(text_obj.get('opacity', 1.0))
+            
+            if not text or fill_color is None or opacity <= 0:
+                return
+            
+            # 从进程内字体注册表获取（已缓存的字体不再重复解析字体文件）
+            font = font_registry.get_font(font_family, font_size)
             
-            # 转换颜色格式
-            if fill_color.startswith('#'):
-                fill_color = tuple(int(fill_color[i:i+2], 16) for i in (1, 3, 5))
+            # 字形可能超出Fabric记录的文字框，四周留一个字号的边距，图层中心仍是对象中心
+            layer = self._new_layer(width, height, font_size, fill_color)
+            draw = ImageDraw.Draw(layer)
             
-            # 尝试加载字体
-            try:
-                # 在实际部署时，需要确保系统中有这些字体文件
-                font_path = self._get_font_path(font_family)
-                font = ImageFont.truetype(font_path, font_size)
-            except:
-                # 如果加载字体失败，使用默认字体
-                font = ImageFont.load_default()
+            # 处理多行文本，行距与Fabric的lineHeight一致
+            line_height = font_size * float(text_obj.get('lineHeight', 1.16))
             
-            # 处理多行文本
-            lines = text.split('\n')
-            y_offset = 0
+            # Fabric的描边以字形轮廓为中线，Pillow的描边全部在轮廓外侧，取一半宽度使外缘一致
+            text_stroke = int(round(stroke_width / 2))
             
-            for line in lines:
-                draw.text((left, top + y_offset), line, font=font, fill=fill_color)
-                # 计算行高
-                bbox = font.getbbox(line)
-                line_height = bbox[3] - bbox[1]
-                y_offset += line_height + 5  # 5像素行间距
+            for i, line in enumerate(text.split('\n')):
+                draw.text(
+                    (font_size, font_size + int(round(i * line_height))), line, font=font, fill=fill_color,
+                    stroke_width=text_stroke, stroke_fill=stroke_color if text_stroke else None
+                )
+            
+            layer = self._transform_layer(
+                layer, angle, opacity, bool(text_obj.get('flipX')), bool(text_obj.get('flipY'))
+            )
+            self._composite_centered(image, layer, center_x, center_y)
         
         except Exception as e:
             logger.error(f"添加文字失败: {str(e)}")
     
-    def _add_image_to_image(self, base_image: Image.Image, image_obj: Dict[str, Any]):
-        """在基础图片上叠加另一张图片（如LOGO）"""
+    def _add_image_to_image(self, base_image: Image.Image, image_obj: Dict[str, Any], canvas_scale: tuple = (1, 1)):
+        """在基础图片上叠加另一张图片（如LOGO），支持缩放、旋转、翻转和透明度"""
         try:
             image_url = image_obj.get('src', '')
-            left = int(image_obj.get('left', 0))
-            top = int(image_obj.get('top', 0))
-            width = int(image_obj.get('width', 100))
-            height = int(image_obj.get('height', 100))
+            width, height, center_x, center_y, angle = self._object_box(image_obj, canvas_scale)
+            width, height = int(round(width)), int(round(height))
             opacity = float(image_obj.get('opacity', 1.0))
+            flip_x = bool(image_obj.get('flipX'))
+            flip_y = bool(image_obj.get('flipY'))
             
-            if not image_url:
+            if not image_url or width <= 0 or height <= 0 or opacity <= 0:
                 return
             
-            # 下载并处理叠加图片
-            overlay_image = self._download_image(image_url)
-            
-            # 调整大小
-            overlay_image = overlay_image.resize((width, height), Image.Resampling.LANCZOS)
+            # 同一素材按相同变换处理后的结果在进程内缓存，批量定稿时只下载和缩放一次
+            src_key = hashlib.sha1(image_url.encode('utf-8')).hexdigest()
+            overlay_image = overlay_cache.get_or_create(
+                ('overlay', src_key, width, height, opacity, angle, flip_x, flip_y),
+                lambda: self._prepare_overlay(image_url, src_key, width, height, opacity, angle, flip_x, flip_y)
+            )
             
-            # 处理透明度
-            if opacity < 1.0:
-                # 创建带透明度的图片
-                overlay_rgba = overlay_image.convert('RGBA')
-                alpha = overlay_rgba.split()[-1]
-                alpha = alpha.point(lambda p: int(p * opacity))
-                overlay_rgba.putalpha(alpha)
-                overlay_image = overlay_rgba
-            
-            # 粘贴到基础图片上
-            if overlay_image.mode == 'RGBA':
-                base_image.paste(overlay_image, (left, top), overlay_image)
-            else:
-                base_image.paste(overlay_image, (left, top))
+            # 旋转后的图片以对象中心定位
+            self._composite_centered(base_image, overlay_image, center_x, center_y)
         
         except Exception as e:
             logger.error(f"添加图片失败: {str(e)}")
     
-    def _add_rectangle_to_image(self, draw: ImageDraw.Draw, rect_obj: Dict[str, Any]):
+    def _prepare_overlay(self, image_url: str, src_key: str, width: int, height: int, opacity: float,
+                         angle: float = 0, flip_x: bool = False, flip_y: bool = False) -> Image.Image:
+        """
+        下载（或从缓存读取）素材原图，按Fabric变换处理为RGBA图片
+        Pillow对RGBA的缩放内部按预乘透明度计算，透明边缘不会出现黑边
+        """
+        source_image = overlay_cache.get_or_create(
+            ('source', src_key), lambda: self._download_image(image_url, mode='RGBA')
+        )
+        
+        # 调整大小
+        overlay_image = source_image.resize((width, height), Image.Resampling.LANCZOS)
+        return self._transform_layer(overlay_image, angle, opacity, flip_x, flip_y)
+    
+    def _composite(self, base_image: Image.Image, overlay_image: Image.Image, left: int, top: int):
+        """把RGBA图片按alpha合成到画布的指定位置，超出画布的部分被裁掉"""
+        crop_left = max(0, -left)
+        crop_top = max(0, -top)
+        crop_right = min(overlay_image.width, base_image.width - left)
+        crop_bottom = min(overlay_image.height, base_image.height - top)
+        
+        if crop_right <= crop_left or crop_bottom <= crop_top:
+            return
+        
+        if (crop_left, crop_top, crop_right, crop_bottom) != (0, 0, overlay_image.width, overlay_image.height):
+            overlay_image = overlay_image.crop((crop_left, crop_top, crop_right, crop_bottom))
+        
+        base_image.alpha_composite(overlay_image, dest=(left + crop_left, top + crop_top))
+    
+    def _add_shape_to_image(self, image: Image.Image, shape_obj: Dict[str, Any], canvas_scale: tuple, draw_shape):
+        """
+        在图片上添加形状：在透明图层上绘制后按对象的旋转、翻转和透明度合成
+        draw_shape(draw, bbox, fill, outline, width) 负责在图层的bbox内绘制
+        """
+        width, height, center_x, center_y, angle = self._object_box(shape_obj, canvas_scale)
+        fill_color = self._parse_color(shape_obj.get('fill', '#000000'))
+        stroke_color = self._parse_color(shape_obj.get('stroke'))
+        stroke_width = self._stroke_width(shape_obj, canvas_scale)
+        opacity = float(shape_obj.get('opacity', 1.0))
+        
+        if (fill_color is None and stroke_color is None) or opacity <= 0:
+            return
+        
+        # Fabric的描边以外接框为中线，Pillow的描边画在bbox内侧，所以bbox向外扩半个描边宽度
+        padding = max(stroke_width, 0)
+        inset = stroke_width / 2 if stroke_color is not None else 0
+        layer = self._new_layer(width, height, padding, fill_color or stroke_color)
+        bbox = [padding - inset, padding - inset, padding + width + inset, padding + height + inset]
+        draw_shape(ImageDraw.Draw(layer), bbox, fill_color, stroke_color, stroke_width)
+        
+        layer = self._transform_layer(
+            layer, angle, opacity, bool(shape_obj.get('flipX')), bool(shape_obj.get('flipY'))
+        )
+        self._composite_centered(image, layer, center_x, center_y)
+    
+    def _add_rectangle_to_image(self, image: Image.Image, rect_obj: Dict[str, Any], canvas_scale: tuple = (1, 1)):
         """在图片上添加矩形"""
         try:
-            left = int(rect_obj.get('left', 0))
-            top = int(rect_obj.get('top', 0))
-            width = int(rect_obj.get('width', 100))
-            height = int(rect_obj.get('height', 100))
-            fill_color = rect_obj.get('fill', '#000000')
-            stroke_color = rect_obj.get('stroke', None)
-            stroke_width = int(rect_obj.get('strokeWidth', 1))
-            
-            # 转换颜色
-            if fill_color and fill_color.startswith('#'):
-                fill_color = tuple(int(fill_color[i:i+2], 16) for i in (1, 3, 5))
-            
-            if stroke_color and stroke_color.startswith('#'):
-                stroke_color = tuple(int(stroke_color[i:i+2], 16) for i in (1, 3, 5))
-            
-            # 绘制矩形
-            bbox = [left, top, left + width, top + height]
-            draw.rectangle(bbox, fill=fill_color, outline=stroke_color, width=stroke_width)
+            self._add_shape_to_image(
+                image, rect_obj, canvas_scale,
+                lambda draw, bbox, fill, outline, width: draw.rectangle(bbox, fill=fill, outline=outline, width=width)
+            )
         
         except Exception as e:
             logger.error(f"添加矩形失败: {str(e)}")
     
-    def _add_circle_to_image(self, draw: ImageDraw.Draw, circle_obj: Dict[str, Any]):
-        """在图片上添加圆形"""
+    def _add_circle_to_image(self, image: Image.Image, circle_obj: Dict[str, Any], canvas_scale: tuple = (1, 1)):
+        """在图片上添加圆形（Fabric的left/top是外接框的原点，不是圆心）"""
         try:
-            left = int(circle_obj.get('left', 0))
-            top = int(circle_obj.get('top', 0))
-            radius = int(circle_obj.get('radius', 50))
-            fill_color = circle_obj.get('fill', '#000000')
-            stroke_color = circle_obj.get('stroke', None)
-            stroke_width = int(circle_obj.get('strokeWidth', 1))
-            
-            # 转换颜色
-            if fill_color and fill_color.startswith('#'):
-                fill_color = tuple(int(fill_color[i:i+2], 16) for i in (1, 3, 5))
-            
-            if stroke_color and stroke_color.startswith('#'):
-                stroke_color = tuple(int(stroke_color[i:i+2], 16) for i in (1, 3, 5))
-            
-            # 绘制圆形
-            bbox = [left - radius, top - radius, left + radius, top + radius]
-            draw.ellipse(bbox, fill=fill_color, outline=stroke_color, width=stroke_width)
+            radius = float(circle_obj.get('radius', 50))
+            self._add_shape_to_image(
+                image, dict(circle_obj, width=radius * 2, height=radius * 2), canvas_scale,
+                lambda draw, bbox, fill, outline, width: draw.ellipse(bbox, fill=fill, outline=outline, width=width)
+            )
         
         except Exception as e:
             logger.error(f"添加圆形失败: {str(e)}")
     
-    def _get_font_path(self, font_family: str) -> str:
-        """获取字体文件路径"""
-        # 字体映射表
-        font_mapping = {
-            'Arial': '/System/Library/Fonts/Arial.ttf',
-            'Times New Roman': '/System/Library/Fonts/Times New Roman.ttf',
-            'Helvetica': '/System/Library/Fonts/Helvetica.ttc',
-            'SimHei': '/System/Library/Fonts/SimHei.ttf',  # 黑体
-            'SimSun': '/System/Library/Fonts/SimSun.ttf',  # 宋体
-        }
-        
-        # 在Windows系统上的字体路径
-        if os.name == 'nt':
-            font_mapping.update({
-                'Arial': 'C:/Windows/Fonts/arial.ttf',
-                'Times New Roman': 'C:/Windows/Fonts/times.ttf',
-                'SimHei': 'C:/Windows/Fonts/simhei.ttf',
-                'SimSun': 'C:/Windows/Fonts/simsun.ttc',
-            })
-        
-        return font_mapping.get(font_family, font_mapping['Arial'])
-    
     def _save_processed_image(self, image: Image.Image) -> str:
         """保存处理后的图片并返回URL"""
         try:
+            # 合成结果仍有透明区域时保存为PNG，否则保存为JPEG
+            transparent = image.mode == 'RGBA' and image.getchannel('A').getextrema()[0] < 255
+            
             # 生成唯一文件名
-            filename = f"processed_{uuid.uuid4().hex}.jpg"
+            filename = f"processed_{uuid.uuid4().hex}.{'png' if transparent else 'jpg'}"
             file_path = os.path.join(self.processed_folder, filename)
             
             # 保存图片
-            image.save(file_path, 'JPEG', quality=95)
+            if transparent:
+                image.save(file_path, 'PNG', optimize=True)
+            else:
+                image.convert('RGB').save(file_path, 'JPEG', quality=95)
             
             # 返回相对URL（实际部署时需要配置为完整URL）
             return f"/static/processed/{filename}"
@@ -0,0 +1,70 @@
+from config import Config
+from utils.redis_client import get_redis
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 每个用户的在线连接 {session_id: 过期时间戳}
+PRESENCE_USER_KEY = 'vm:presence:user:{user_id}'
+# 所有在线用户 {user_id: 最近一次心跳的过期时间戳}
+PRESENCE_USERS_KEY = 'vm:presence:users'
+
+class PresenceRegistry:
+    """
+    跨进程的在线状态注册表 - 每个连接以 用户 -> 连接ID 的形式记录在Redis中，
+    由持有连接的进程定期心跳续期，进程异常退出时连接随过期时间自动下线
+    """
+    
+    def __init__(self, ttl: int):
+        self.ttl = ttl
+    
+    def register(self, user_id: int, session_id: str):
+        """记录（或续期）用户的一个连接"""
+        self.refresh({session_id: user_id})
+    
+    def refresh(self, sessions: dict):
+        """批量续期连接 {session_id: user_id}"""
+        if not sessions:
+            return
+        
+        expires_at = time.time() + self.ttl
+        pipe = get_redis().pipeline(transaction=False)
+        for session_id, user_id in sessions.items():
+            user_key = PRESENCE_USER_KEY.format(user_id=user_id)
+            pipe.zadd(user_key, {session_id: expires_at})
+            pipe.expire(user_key, self.ttl)
+            pipe.zadd(PRESENCE_USERS_KEY, {user_id: expires_at})
+        pipe.execute()
+    
+    def unregister(self, user_id: int, session_id: str):
+        """移除用户的一个连接，没有其他有效连接时用户下线"""
+        redis_client = get_redis()
+        user_key = PRESENCE_USER_KEY.format(user_id=user_id)
+        
+        pipe = redis_client.pipeline()
+        pipe.zrem(user_key, session_id)
+        pipe.zremrangebyscore(user_key, '-inf', time.time())
+        pipe.zcard(user_key)
+        remaining = pipe.execute()[-1]
+        
+        if not remaining:
+            redis_client.zrem(PRESENCE_USERS_KEY, user_id)
+    
+    def is_online(self, user_id: int) -> bool:
+        """用户是否有未过期的连接，Redis不可用时按在线处理，避免漏推"""
+        try:
+            return get_redis().zcount(PRESENCE_USER_KEY.format(user_id=user_id), time.time(), '+inf') > 0
+        except Exception as e:
+            logger.warning(f"读取用户 {user_id} 在线状态失败: {str(e)}")
+            return True
+    
+    def online_users(self) -> list:
+        """所有在线用户ID"""
+        redis_client = get_redis()
+        now = time.time()
+        redis_client.zremrangebyscore(PRESENCE_USERS_KEY, '-inf', now)
+        return [int(user_id) for user_id in redis_client.zrangebyscore(PRESENCE_USERS_KEY, now, '+inf')]
+
+# 进程内共享的在线状态注册表
+presence_registry = PresenceRegistry(Config.PRESENCE_TTL)
@@ -0,0 +1,147 @@
+from config import Config
+from models import APIChannel, APIModel, PROVIDER_CAPABILITIES, db
+from utils.redis_client import get_redis, get_pubsub_redis
+from collections import namedtuple
+from typing import List
+import threading
+import time
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 路由表中缓存的是与数据库会话无关的快照，可以跨请求、跨线程安全使用
+ChannelSnapshot = namedtuple('ChannelSnapshot', ['id', 'name', 'base_url', 'api_key', 'latency_ms'])
+ModelSnapshot = namedtuple('ModelSnapshot', [
+    'id', 'channel_id', 'model_name', 'priority', 'provider', 'capability', 'max_concurrency', 'max_batch_size', 'cost_per_call'
+])
+
+class RoutingTable:
+    """
+    进程内的通道/模型路由表缓存
+    
+    热路径上选择通道不再查询数据库。缓存在TTL到期或收到失效通知时重新加载，
+    失效通知通过Redis发布订阅广播到所有进程（管理员修改通道、健康检查结果等）。
+    """
+    
+    INVALIDATE_CHANNEL = 'vm:routing:invalidate'
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._routes = None
+        self._loaded_at = 0
+        self._version = 0  # 每次失效递增，防止加载期间收到的失效通知被覆盖
+        self._listener_pid = None
+    
+    def get(self, model_type: str = 'analysis') -> List[dict]:
+        """获取指定能力（analysis/generation）的可用通道路由列表"""
+        self._ensure_listener()
+        
+        with self._lock:
+            if self._routes is not None and time.time() - self._loaded_at < Config.ROUTING_TABLE_TTL:
+                return list(self._routes.get(model_type, []))
+            version = self._version
+        
+        routes = self._load()
+        with self._lock:
+            if version == self._version:
+                self._routes = routes
+                self._loaded_at = time.time()
+        return list(routes.get(model_type, []))
+    
+    def invalidate(self, broadcast: bool = True):
+        """使路由表失效，默认同时通知其他进程"""
+        self._clear()
+        
+        if broadcast:
+            try:
+                get_redis().publish(self.INVALIDATE_CHANNEL, str(os.getpid()))
+            except Exception as e:
+                logger.warning(f"广播路由表失效通知失败: {str(e)}")
+    
+    def _clear(self):
+        with self._lock:
+            self._routes = None
+            self._version += 1
+    
+    def _load(self) -> dict:
+        """从数据库加载路由表，按能力建立索引 {capability: [route]}"""
+        rows = db.session.query(APIChannel, APIModel).join(
+            APIModel, APIChannel.id == APIModel.channel_id
+        ).filter(
+            APIChannel.is_active == True,
+            APIChannel.is_healthy == True,
+            APIModel.is_active == True,
+            APIModel.is_available == True
+        ).order_by(
+            # 同优先级按单次成本升序，未填写成本的排在最后
+            APIModel.priority.asc(),
+            APIModel.cost_per_call.is_(None),
+            APIModel.cost_per_call.asc()
+        ).all()
+        
+        routes = {}
+        for channel, model in rows:
+            provider, capability = model.resolve_provider()
+            if provider not in PROVIDER_CAPABILITIES:
+                logger.warning(f"模型 {model.model_name} 未登记服务商，已忽略")
+                continue
+            
+            routes.setdefault(capability, []).append({
+                'channel': ChannelSnapshot(
+                    id=channel.id,
+                    name=channel.name,
+                    base_url=channel.base_url,
+                    api_key=channel.api_key,
+                    latency_ms=channel.latency_ms
+                ),
+                'model': ModelSnapshot(
+                    id=model.id,
+                    channel_id=model.channel_id,
+                    model_name=model.model_name,
+                    priority=model.priority,
+                    provider=provider,
+                    capability=capability,
+                    max_concurrency=model.max_concurrency,
+                    max_batch_size=model.max_batch_size,
+                    cost_per_call=model.cost_per_call
+                ),
+                'priority': model.priority
+            })
+        
+        counts = {capability: len(items) for capability, items in routes.items()}
+        logger.info(f"路由表已加载: {counts}")
+        return routes
+    
+    def _ensure_listener(self):
+        """在当前进程中启动失效通知监听线程（fork出的子进程需要重新启动）"""
+        if self._listener_pid == os.getpid():
+            return
+        
+        with self._lock:
+            if self._listener_pid == os.getpid():
+                return
+            self._listener_pid = os.getpid()
+        
+        thread = threading.Thread(target=self._listen, name='routing-table-listener', daemon=True)
+        thread.start()
+    
+    def _listen(self):
+        """订阅失效通知，断线后自动重连"""
+        while True:
+            try:
+                pubsub = get_pubsub_redis().pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.INVALIDATE_CHANNEL)
+                # 重连期间可能错过通知，订阅成功后先清空一次
+                self._clear()
+                
+                for message in pubsub.listen():
+                    if message['type'] == 'message':
+                        self._clear()
+            
+            except Exception as e:
+                logger.warning(f"路由表失效通知订阅中断: {str(e)}")
+                time.sleep(5)
+
+# 进程内共享的路由表实例
+routing_table = RoutingTable()
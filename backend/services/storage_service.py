@@ -0,0 +1,182 @@
+from config import Config
+from PIL import Image
+from services.http_pool import HTTPSessionPool
+from services.upload_service import HashingFileStream, sniff_image_format, IMAGE_EXTENSIONS
+from urllib.parse import urlsplit
+from typing import Optional
+import base64
+import binascii
+import tempfile
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+class StorageService:
+    """
+    生成图片的本地存储 - 按内容哈希存放，同一张图片只保存一份
+    
+    服务商返回的URL会过期，Stable Diffusion返回的是base64数据，
+    统一在生成阶段落盘一次，之后的定稿、缩略图等处理都直接读取本地文件。
+    """
+    
+    URL_PREFIX = '/static'
+    
+    # 派生图规格 {名称: 最大边长}，原图即为完整尺寸
+    DERIVATIVES = {
+        'thumb': Config.THUMBNAIL_SIZE,
+        'preview': Config.PREVIEW_SIZE
+    }
+    
+    @staticmethod
+    def ingest(source: str) -> dict:
+        """
+        保存生成结果（图片URL、data URI或base64数据），
+        返回 {url, path, content_hash, format, size, width, height, thumbnail_url, preview_url}
+        """
+        os.makedirs(Config.GENERATED_FOLDER, exist_ok=True)
+        stream = HashingFileStream(Config.GENERATED_FOLDER, Config.GENERATED_MAX_SIZE)
+        
+        try:
+            if source.startswith(('http://', 'https://')):
+                StorageService._download(source, stream)
+            else:
+                StorageService._decode(source, stream)
+            
+            image_format = sniff_image_format(stream.header)
+            if image_format is None:
+                raise ValueError('生成结果不是支持的图片格式')
+            
+            content_hash = stream.content_hash
+            file_path = StorageService._content_path(content_hash, image_format)
+            
+            if os.path.exists(file_path):
+                logger.info(f"生成图片 {content_hash[:12]} 已存在，复用已有文件")
+            else:
+                os.makedirs(os.path.dirname(file_path), exist_ok=True)
+                stream.persist(file_path)
+        finally:
+            stream.close()
+        
+        with Image.open(file_path) as image:
+            width, height = image.size
+        
+        # 派生图生成失败不影响原图保存，列表页回退到原图
+        try:
+            derivatives = StorageService.create_derivatives(file_path, content_hash)
+        except Exception as e:
+            logger.error(f"生成派生图失败: {str(e)}")
+            derivatives = {}
+        
+        return {
+            'url': StorageService.url_for(file_path),
+            'path': file_path,
+            'content_hash': content_hash,
+            'format': image_format,
+            'size': stream.size,
+            'width': width,
+            'height': height,
+            'thumbnail_url': derivatives.get('thumb'),
+            'preview_url': derivatives.get('preview')
+        }
+    
+    @staticmethod
+    def create_derivatives(file_path: str, content_hash: str) -> dict:
+        """
+        生成各规格的WEBP派生图，返回 {名称: URL}
+        派生图路径由内容哈希决定，已存在时直接复用
+        """
+        derivatives = {}
+        pending = {}
+        
+        for name, max_dimension in StorageService.DERIVATIVES.items():
+            derived_path = os.path.join(os.path.dirname(file_path), f"{content_hash}_{name}.webp")
+            derivatives[name] = StorageService.url_for(derived_path)
+            if not os.path.exists(derived_path):
+                pending[derived_path] = max_dimension
+        
+        if not pending:
+            return derivatives
+        
+        with Image.open(file_path) as image:
+            image.draft('RGB', (max(pending.values()),) * 2)
+            image.load()
+            
+            if image.mode not in ('RGB', 'RGBA'):
+                image = image.convert('RGBA' if 'transparency' in image.info or image.mode in ('LA', 'PA') else 'RGB')
+            
+            # 从大到小依次缩小，每一级都以上一级为源，减少重采样的像素量
+            source = image
+            for derived_path, max_dimension in sorted(pending.items(), key=lambda item: -item[1]):
+                derived = source.copy()
+                derived.thumbnail((max_dimension, max_dimension), Image.Resampling.LANCZOS)
+                
+                StorageService._save_atomic(derived, derived_path)
+                source = derived
+        
+        return derivatives
+    
+    @staticmethod
+    def _save_atomic(image: Image.Image, derived_path: str):
+        """
+        先写入同目录下的唯一临时文件再原子替换，
+        并行保存同一内容哈希的派生图时不会互相覆盖出不完整的文件
+        """
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(derived_path), prefix='.derived_', suffix='.part')
+        try:
+            with os.fdopen(fd, 'wb') as tmp_file:
+                image.save(tmp_file, 'WEBP', quality=Config.DERIVATIVE_WEBP_QUALITY, method=4)
+            os.replace(tmp_path, derived_path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+    
+    @staticmethod
+    def url_for(file_path: str) -> str:
+        """本地文件对应的访问URL（nginx将/static映射到backend目录）"""
+        return f"{StorageService.URL_PREFIX}/{file_path.replace(os.sep, '/')}"
+    
+    @staticmethod
+    def local_path(image_url: str) -> Optional[str]:
+        """本地存储图片的URL转换为文件路径，不是本地图片时返回None"""
+        if not image_url or not image_url.startswith(StorageService.URL_PREFIX + '/'):
+            return None
+        
+        relative_path = os.path.normpath(image_url[len(StorageService.URL_PREFIX) + 1:])
+        if relative_path.startswith('..') or os.path.isabs(relative_path):
+            return None
+        
+        return relative_path if os.path.exists(relative_path) else None
+    
+    @staticmethod
+    def _content_path(content_hash: str, image_format: str) -> str:
+        """按哈希前缀分两级目录，避免单个目录下文件过多"""
+        return os.path.join(
+            Config.GENERATED_FOLDER,
+            content_hash[:2],
+            content_hash[2:4],
+            f"{content_hash}.{IMAGE_EXTENSIONS[image_format]}"
+        )
+    
+    @staticmethod
+    def _download(image_url: str, stream: HashingFileStream):
+        """流式下载远程图片，复用按站点划分的HTTP连接池"""
+        parts = urlsplit(image_url)
+        session = HTTPSessionPool.get_session(f"{parts.scheme}://{parts.netloc}")
+        
+        with session.get(image_url, stream=True, timeout=Config.GENERATED_DOWNLOAD_TIMEOUT) as response:
+            response.raise_for_status()
+            for chunk in response.iter_content(chunk_size=65536):
+                stream.write(chunk)
+    
+    @staticmethod
+    def _decode(data: str, stream: HashingFileStream):
+        """解码base64图片数据（兼容data URI）"""
+        if data.startswith('data:'):
+            data = data.split(',', 1)[-1]
+        
+        try:
+            stream.write(base64.b64decode(data, validate=True))
+        except binascii.Error as e:
+            raise ValueError('生成结果不是有效的base64图片数据') from e
@@ -0,0 +1,205 @@
+from flask import Request, current_app
+from PIL import Image, ImageOps
+from werkzeug.exceptions import RequestEntityTooLarge
+from config import Config
+from typing import Optional
+import hashlib
+import io
+import tempfile
+import uuid
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 文件头魔数 -> 图片格式
+IMAGE_SIGNATURES = [
+    (b'\xff\xd8\xff', 'jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'GIF87a', 'gif'),
+    (b'GIF89a', 'gif'),
+]
+
+IMAGE_EXTENSIONS = {
+    'jpeg': 'jpg',
+    'png': 'png',
+    'gif': 'gif',
+    'webp': 'webp'
+}
+
+def sniff_image_format(header: bytes) -> Optional[str]:
+    """根据文件头识别真实的图片格式"""
+    for signature, image_format in IMAGE_SIGNATURES:
+        if header.startswith(signature):
+            return image_format
+    if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+        return 'webp'
+    return None
+
+class HashingFileStream:
+    """
+    上传文件的落盘流 - 边接收边写入上传目录，同时计算SHA-256并保留文件头用于格式识别
+    """
+    
+    HEADER_SIZE = 16
+    
+    def __init__(self, directory: str, max_size: int):
+        fd, self.path = tempfile.mkstemp(dir=directory, prefix='.upload_', suffix='.part')
+        self._file = os.fdopen(fd, 'w+b')
+        self._digest = hashlib.sha256()
+        self._persisted = False
+        self.max_size = max_size
+        self.header = b''
+        self.size = 0
+    
+    def write(self, data: bytes) -> int:
+        self.size += len(data)
+        if self.size > self.max_size:
+            raise RequestEntityTooLarge()
+        
+        if len(self.header) < self.HEADER_SIZE:
+            self.header += data[:self.HEADER_SIZE - len(self.header)]
+        
+        self._digest.update(data)
+        return self._file.write(data)
+    
+    @property
+    def content_hash(self) -> str:
+        return self._digest.hexdigest()
+    
+    def persist(self, file_path: str):
+        """将临时文件移动到最终位置"""
+        self._file.close()
+        os.replace(self.path, file_path)
+        self.path = file_path
+        self._persisted = True
+    
+    def close(self):
+        """关闭流，未被保存的临时文件会被删除"""
+        self._file.close()
+        if not self._persisted and os.path.exists(self.path):
+            os.remove(self.path)
+    
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+class UploadRequest(Request):
+    """上传的文件直接流式写入上传目录，不再先缓存到内存或系统临时目录"""
+    
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return HashingFileStream(current_app.config['UPLOAD_FOLDER'], current_app.config['MAX_CONTENT_LENGTH'])
+
+class UploadService:
+    """上传图片处理服务 - 格式校验、内容哈希和超大图片降采样"""
+    
+    @staticmethod
+    def save_upload(file_storage, upload_folder: str) -> dict:
+        """
+        保存上传的图片，返回 {path, content_hash, format, size, width, height}
+        文件格式以文件头为准，与扩展名无关；不支持的格式抛出ValueError
+        """
+        source = file_storage.stream
+        if isinstance(source, HashingFileStream):
+            stream = source
+        else:
+            stream = HashingFileStream(upload_folder, Config.MAX_CONTENT_LENGTH)
+        
+        try:
+            if stream is not source:
+                # 未经UploadRequest接收的文件（如测试客户端）在此补做流式落盘，中途超限或出错时临时文件随close删除
+                for chunk in iter(lambda: source.read(65536), b''):
+                    stream.write(chunk)
+            
+            image_format = sniff_image_format(stream.header)
+            if image_format is None:
+                raise ValueError('不支持的文件格式')
+            
+            file_path = os.path.join(upload_folder, f"{uuid.uuid4().hex}.{IMAGE_EXTENSIONS[image_format]}")
+            stream.persist(file_path)
+        finally:
+            stream.close()
+        
+        try:
+            width, height = UploadService._downsample(file_path, image_format)
+        except (OSError, Image.DecompressionBombError) as e:
+            os.remove(file_path)
+            raise ValueError('图片文件无法解析') from e
+        
+        return {
+            'path': file_path,
+            'content_hash': stream.content_hash,
+            'format': image_format,
+            'size': stream.size,
+            'width': width,
+            'height': height
+        }
+    
+    @staticmethod
+    def _downsample(file_path: str, image_format: str) -> tuple:
+        """超过最大边长的图片就地缩小，返回最终尺寸"""
+        max_dimension = Config.UPLOAD_MAX_DIMENSION
+        
+        with Image.open(file_path) as image:
+            width, height = image.size
+            if max(width, height) <= max_dimension or image_format == 'gif':
+                return width, height
+            
+            # JPEG按目标尺寸解码，避免完整解码超大图片
+            image.draft('RGB', (max_dimension, max_dimension))
+            image = ImageOps.exif_transpose(image)
+            image.thumbnail((max_dimension, max_dimension), Image.Resampling.LANCZOS)
+            
+            if image_format == 'jpeg':
+                image.convert('RGB').save(file_path, 'JPEG', quality=90)
+            else:
+                image.save(file_path, image_format.upper())
+            
+            logger.info(f"上传图片 {width}x{height} 已缩小为 {image.width}x{image.height}")
+            return image.size
+    
+    @staticmethod
+    def prepare_for_vision(image_path: str, max_dimension: int) -> tuple:
+        """
+        生成发送给视觉模型的图片，返回 (图片字节, mime类型)
+        
+        缩小到模型可用的最大边长并重新编码为JPEG，派生文件缓存在原图旁边，
+        同一张图片多次分析（重试、对冲、多通道切换）时只处理一次。
+        已经足够小的JPEG原图直接使用，避免重复压缩。
+        """
+        root, _ = os.path.splitext(image_path)
+        derived_path = f"{root}.vision_{max_dimension}.jpg"
+        
+        if os.path.exists(derived_path):
+            with open(derived_path, 'rb') as derived_file:
+                return derived_file.read(), 'image/jpeg'
+        
+        with Image.open(image_path) as image:
+            if image.format == 'JPEG' and max(image.size) <= max_dimension:
+                with open(image_path, 'rb') as image_file:
+                    return image_file.read(), 'image/jpeg'
+            
+            image.draft('RGB', (max_dimension, max_dimension))
+            image = ImageOps.exif_transpose(image)
+            image.thumbnail((max_dimension, max_dimension), Image.Resampling.LANCZOS)
+            
+            # 透明背景铺白底后再编码为JPEG
+            if image.mode in ('RGBA', 'LA', 'P'):
+                image = image.convert('RGBA')
+                background = Image.new('RGB', image.size, (255, 255, 255))
+                background.paste(image, mask=image.split()[-1])
+                image = background
+            elif image.mode != 'RGB':
+                image = image.convert('RGB')
+            
+            buffer = io.BytesIO()
+            image.save(buffer, 'JPEG', quality=Config.VISION_JPEG_QUALITY, optimize=True)
+        
+        data = buffer.getvalue()
+        
+        # 先写临时文件再原子替换，避免并发分析读到写了一半的文件
+        tmp_path = f"{derived_path}.{uuid.uuid4().hex}.part"
+        with open(tmp_path, 'wb') as derived_file:
+            derived_file.write(data)
+        os.replace(tmp_path, derived_path)
+        
+        return data, 'image/jpeg'
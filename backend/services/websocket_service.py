@@ -1,17 +1,68 @@
+from flask import request
 from flask_socketio import SocketIO, emit, join_room, leave_room
+from config import Config
+from services.presence_service import presence_registry
+from services.event_stream import task_event_stream
+from collections import deque
+import itertools
+import threading
+import os
 import logging
 
 logger = logging.getLogger(__name__)
 
 class WebSocketService:
+    """
+    WebSocket推送服务 - 所有进程的推送都经过Redis消息队列，
+    由持有该用户连接的Web worker实际下发，Celery worker等没有socket服务的进程也可以推送
+    """
+    
     socketio = None
-    connected_users = {}  # {user_id: [session_ids]}
+    
+    # 本进程持有的连接 {sid: user_id}，由心跳任务定期在在线状态注册表中续期
+    _sessions = {}
+    _sessions_lock = threading.Lock()
+    _heartbeat_pid = None
+    
+    # 没有socket服务的进程（Celery worker）使用只写的推送实例
+    _emitter = None
+    _emitter_pid = None
+    
+    # 进度类事件在合并窗口内按用户缓冲，合并为一帧 {event}_batch 发送
+    COALESCED_EVENTS = ('generation_progress',)
+    _buffer_lock = threading.Lock()
+    _buffers = {}  # {(user_id, event): {'events': deque, 'dropped': 丢弃数}}
+    # 发送锁按 (user_id, event) 分段，取出缓冲和发送在同一把锁内完成，
+    # 其他事件发送前等待同一用户进行中的合并发送结束，保证顺序
+    _flush_locks = [threading.Lock() for _ in range(32)]
+    _emit_counter = itertools.count(1)
     
     @classmethod
     def init_app(cls, app):
-        cls.socketio = SocketIO(app, cors_allowed_origins="*", async_mode='threading')
+        cls.socketio = SocketIO(
+            app,
+            cors_allowed_origins="*",
+            async_mode=Config.SOCKETIO_ASYNC_MODE,
+            message_queue=Config.SOCKETIO_MESSAGE_QUEUE,
+            channel=Config.SOCKETIO_CHANNEL
+        )
         cls._register_events()
     
+    @classmethod
+    def _get_emitter(cls) -> SocketIO:
+        """获取推送实例：Web进程使用socket服务本身，其他进程使用连接消息队列的只写实例"""
+        if cls.socketio is not None:
+            return cls.socketio
+        
+        # fork出的子进程不能复用父进程的Redis连接
+        if cls._emitter is None or cls._emitter_pid != os.getpid():
+            cls._emitter = SocketIO(
+                message_queue=Config.SOCKETIO_MESSAGE_QUEUE,
+                channel=Config.SOCKETIO_CHANNEL
+            )
+            cls._emitter_pid = os.getpid()
+        return cls._emitter
+    
     @classmethod
     def _register_events(cls):
         """注册WebSocket事件"""
@@ -23,6 +74,7 @@ class WebSocketService:
         
         @cls.socketio.on('disconnect')
         def handle_disconnect():
+            cls._remove_session(request.sid)
             logger.info("客户端断开连接")
         
         @cls.socketio.on('join_user_room')
@@ -32,11 +84,7 @@ class WebSocketService:
             if user_id:
                 room = f"user_{user_id}"
                 join_room(room)
-                
-                # 记录连接的用户
-                if user_id not in cls.connected_users:
-                    cls.connected_users[user_id] = []
-                cls.connected_users[user_id].append(request.sid)
+                cls._add_session(request.sid, user_id)
                 
                 emit('joined_room', {'room': room})
                 logger.info(f"用户 {user_id} 加入房间 {room}")
@@ -48,35 +96,143 @@ class WebSocketService:
             if user_id:
                 room = f"user_{user_id}"
                 leave_room(room)
-                
-                # 移除连接记录
-                if user_id in cls.connected_users:
-                    cls.connected_users[user_id] = [
-                        sid for sid in cls.connected_users[user_id] 
-                        if sid != request.sid
-                    ]
-                    if not cls.connected_users[user_id]:
-                        del cls.connected_users[user_id]
+                cls._remove_session(request.sid)
                 
                 emit('left_room', {'room': room})
                 logger.info(f"用户 {user_id} 离开房间 {room}")
     
+    @classmethod
+    def _add_session(cls, sid: str, user_id: int):
+        """记录连接的用户并确保本进程的心跳任务已启动"""
+        with cls._sessions_lock:
+            cls._sessions[sid] = user_id
+            start_heartbeat = cls._heartbeat_pid != os.getpid()
+            cls._heartbeat_pid = os.getpid()
+        
+        if start_heartbeat:
+            cls.socketio.start_background_task(cls._heartbeat_loop)
+        
+        try:
+            presence_registry.register(user_id, sid)
+        except Exception as e:
+            logger.error(f"记录用户 {user_id} 在线状态失败: {str(e)}")
+    
+    @classmethod
+    def _remove_session(cls, sid: str):
+        with cls._sessions_lock:
+            user_id = cls._sessions.pop(sid, None)
+        if user_id is None:
+            return
+        
+        try:
+            presence_registry.unregister(user_id, sid)
+        except Exception as e:
+            logger.error(f"移除用户 {user_id} 在线状态失败: {str(e)}")
+    
+    @classmethod
+    def _heartbeat_loop(cls):
+        """定期续期本进程持有的所有连接，进程退出后这些连接随过期时间自动下线"""
+        while True:
+            cls.socketio.sleep(Config.PRESENCE_HEARTBEAT_INTERVAL)
+            with cls._sessions_lock:
+                sessions = dict(cls._sessions)
+            try:
+                presence_registry.refresh(sessions)
+            except Exception as e:
+                logger.error(f"在线状态心跳失败: {str(e)}")
+    
     @classmethod
     def emit_to_user(cls, user_id: int, event: str, data: dict):
-        """向特定用户发送消息"""
-        if cls.socketio:
-            room = f"user_{user_id}"
-            cls.socketio.emit(event, data, room=room)
-            logger.info(f"向用户 {user_id} 发送事件 {event}: {data}")
+        """
+        向特定用户发送消息，用户不在线时直接跳过，进度类事件先缓冲再合并发送
+        任务事件同时写入任务事件流，供SSE连接读取和断线后补发
+        """
+        if 'task_id' in data:
+            try:
+                task_event_stream.publish(data['task_id'], event, data)
+            except Exception as e:
+                logger.error(f"写入任务 {data['task_id']} 事件流失败: {str(e)}")
+        
+        if not presence_registry.is_online(user_id):
+            return
+        
+        if event in cls.COALESCED_EVENTS:
+            cls._buffer_event(user_id, event, data)
+            return
+        
+        # 先发出缓冲中的进度，保证客户端先收到进度再收到完成等事件
+        cls.flush_user(user_id)
+        cls._emit(event, data, room=f"user_{user_id}")
     
     @classmethod
     def emit_to_all(cls, event: str, data: dict):
         """向所有连接的客户端发送消息"""
-        if cls.socketio:
-            cls.socketio.emit(event, data)
-            logger.info(f"向所有用户发送事件 {event}: {data}")
+        cls._emit(event, data)
+    
+    @classmethod
+    def flush_user(cls, user_id: int):
+        """立即发送该用户所有缓冲中的事件，定时器正在发送时等待其发送完成"""
+        for event in cls.COALESCED_EVENTS:
+            cls._flush((user_id, event))
+    
+    @classmethod
+    def flush_all(cls):
+        """发送所有缓冲中的事件（进程退出前调用）"""
+        with cls._buffer_lock:
+            keys = list(cls._buffers)
+        for key in keys:
+            cls._flush(key)
+    
+    @classmethod
+    def _buffer_event(cls, user_id: int, event: str, data: dict):
+        """
+        缓冲一条事件，窗口内的第一条事件负责排期发送，同一用户每个窗口最多发送一帧
+        客户端跟不上时缓冲只保留最新的事件，丢弃数随帧发送，完整结果由最终的完成事件补齐
+        """
+        key = (user_id, event)
+        with cls._buffer_lock:
+            pending = cls._buffers.get(key)
+            if pending is None:
+                pending = cls._buffers[key] = {
+                    'events': deque(maxlen=Config.WEBSOCKET_BUFFER_MAX),
+                    'dropped': 0
+                }
+                timer = threading.Timer(Config.WEBSOCKET_COALESCE_WINDOW, cls._flush, args=(key,))
+                timer.daemon = True
+                timer.start()
+            
+            if len(pending['events']) == pending['events'].maxlen:
+                pending['dropped'] += 1
+            pending['events'].append(data)
+    
+    @classmethod
+    def _flush(cls, key):
+        with cls._flush_locks[hash(key) % len(cls._flush_locks)]:
+            with cls._buffer_lock:
+                pending = cls._buffers.pop(key, None)
+            if not pending:
+                return
+            
+            user_id, event = key
+            cls._emit(
+                f"{event}_batch",
+                {'events': list(pending['events']), 'dropped': pending['dropped']},
+                room=f"user_{user_id}"
+            )
+    
+    @classmethod
+    def _emit(cls, event: str, data: dict, room: str = None):
+        target = room or '所有用户'
+        try:
+            cls._get_emitter().emit(event, data, room=room)
+            
+            # 推送内容只抽样记录，避免高并发时日志量随推送次数增长
+            if logger.isEnabledFor(logging.DEBUG) and next(cls._emit_counter) % Config.WEBSOCKET_LOG_SAMPLE_EVERY == 1:
+                logger.debug(f"向 {target} 发送事件 {event}: {data}")
+        except Exception as e:
+            logger.error(f"向 {target} 发送事件 {event} 失败: {str(e)}")
     
     @classmethod
     def get_connected_users(cls):
-        """获取当前连接的用户列表"""
-        return list(cls.connected_users.keys())
\ No newline at end of file
+        """获取当前在线的用户列表（所有Web worker）"""
+        return presence_registry.online_users()
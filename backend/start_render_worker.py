@@ -0,0 +1,19 @@
+#!/usr/bin/env python
+import os
+from celery_app import celery
+
+if __name__ == '__main__':
+    # 设置环境变量
+    os.environ.setdefault('FLASK_ENV', 'development')
+    
+    # 启动定稿渲染worker，CPU密集的图片合成按核数分配进程
+    celery.start(argv=[
+        'celery',
+        'worker',
+        '--app=celery_app.celery',
+        '--loglevel=info',
+        '--queues=render',
+        '--hostname=render@%h',
+        f"--concurrency={os.environ.get('RENDER_CONCURRENCY', os.cpu_count() or 2)}",
+        '--max-tasks-per-child=200'
+    ])
\ No newline at end of file
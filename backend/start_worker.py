@@ -13,6 +13,6 @@ if __name__ == '__main__':
         'worker',
         '--app=celery_app.celery',
         '--loglevel=info',
-        '--queues=analysis,generation,health',
+        '--queues=analysis,generation,polling,health',
         '--concurrency=4'
     ])
\ No newline at end of file
@@ -1,16 +1,32 @@
 from celery_app import celery
-from models import db, AITask, GeneratedResult, StyleTemplates, APIChannel, APIModel
-from services.ai_service import AIService
+from config import Config
+from flask import current_app
+from models import db, AITask, GeneratedResult, ProviderJob, StyleTemplates, APIChannel, APIModel
+from services.ai_service import AIService, PendingJob
+from services.async_ai_service import AsyncAIService
+from services.analysis_cache import analysis_cache
+from services.circuit_breaker import circuit_breaker
+from services.storage_service import StorageService
 from services.websocket_service import WebSocketService
+from utils.redis_client import get_redis
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
+import asyncio
 import traceback
 import logging
 
 logger = logging.getLogger(__name__)
 
+async def _analyze_image_hedged(image_path, prompt):
+    """使用对冲请求进行图片分析"""
+    async with AsyncAIService() as ai_service:
+        return await ai_service.analyze_image_hedged(image_path, prompt)
+
 @celery.task(bind=True, max_retries=3)
-def analyze_task(self, task_id, image_path, user_prompt=None, style_id=None):
+def analyze_task(self, task_id, image_path, user_prompt=None, style_id=None, image_hash=None):
     """
     图片分析任务
+    image_hash为上传时计算的原图内容哈希，用作分析缓存的键
     """
     task = None
     try:
@@ -38,12 +54,28 @@ def analyze_task(self, task_id, image_path, user_prompt=None, style_id=None):
         
         prompt += "\n请生成一个详细的、适合AI图像生成的提示词，要求包含场景描述、光线设置、构图建议等。"
         
-        # 调用AI服务进行分析
-        ai_service = AIService()
-        analysis_result = ai_service.analyze_image(image_path, prompt)
+        # 相同图片和相同需求的分析结果直接复用
+        # 缓存键始终使用上传原图的哈希，磁盘上的文件可能已被缩小，其哈希与原图不同；
+        # 没有原图哈希的历史任务不使用缓存
+        image_hash = image_hash or task.original_image_hash
+        cache_key = analysis_cache.make_key(image_hash, prompt) if image_hash else None
+        analysis_result = analysis_cache.get(cache_key) if cache_key else None
         
-        if not analysis_result:
-            raise Exception("AI分析返回空结果")
+        if analysis_result:
+            logger.info(f"分析任务 {task_id} 命中缓存")
+        else:
+            # 调用AI服务进行分析
+            if Config.ANALYSIS_HEDGING_ENABLED:
+                analysis_result = asyncio.run(_analyze_image_hedged(image_path, prompt))
+            else:
+                ai_service = AIService()
+                analysis_result = ai_service.analyze_image(image_path, prompt)
+            
+            if not analysis_result:
+                raise Exception("AI分析返回空结果")
+            
+            if cache_key:
+                analysis_cache.set(cache_key, analysis_result)
         
         # 更新任务结果
         task.gemini_prompt = analysis_result
@@ -90,6 +122,129 @@ def analyze_task(self, task_id, image_path, user_prompt=None, style_id=None):
         
         raise e
 
+# 生成任务仍在提交图片期间设置此标记，轮询任务不会提前汇总该任务
+SUBMITTING_KEY = 'vm:generation:{task_id}:submitting'
+# 轮询任务已排期标记，避免每个作业提交时都排一个轮询任务
+POLL_SCHEDULED_KEY = 'vm:provider_jobs:poll_scheduled'
+
+def _generate_batch(app, prompt, size):
+    """
+    在线程池中生成一批图片并保存到本地存储，每个线程使用独立的应用上下文和数据库会话
+    返回PendingJob或本地存储信息（见StorageService.ingest）的列表
+    """
+    with app.app_context():
+        images = AIService().generate_batch(prompt, size, defer=True)
+        return [image if isinstance(image, PendingJob) else _ingest_image(image) for image in images]
+
+def _ingest_image(image_url):
+    """保存生成图片到本地存储，下载失败时保留服务商URL，无法保存的base64数据返回None"""
+    try:
+        return StorageService.ingest(image_url)
+    except Exception as e:
+        logger.error(f"保存生成图片失败: {str(e)}")
+        if image_url.startswith(('http://', 'https://')) and len(image_url) <= 500:
+            return {'url': image_url}
+        return None
+
+def _new_generated_result(task_id, stored):
+    """根据本地存储信息创建生成结果记录"""
+    return GeneratedResult(
+        task_id=task_id,
+        image_url=stored['url'],
+        thumbnail_url=stored.get('thumbnail_url'),
+        preview_url=stored.get('preview_url'),
+        content_hash=stored.get('content_hash'),
+        file_size=stored.get('size'),
+        width=stored.get('width'),
+        height=stored.get('height')
+    )
+
+def _schedule_provider_poll():
+    """排期一次第三方作业轮询，已排期时不重复排期"""
+    try:
+        if not get_redis().set(POLL_SCHEDULED_KEY, 1, nx=True, ex=Config.MIDJOURNEY_POLL_INTERVAL * 4):
+            return
+    except Exception as e:
+        logger.warning(f"轮询排期标记写入失败: {str(e)}")
+    
+    poll_provider_jobs.apply_async(countdown=Config.MIDJOURNEY_POLL_INTERVAL)
+
+def _emit_generation_progress(task, stored):
+    """推送单张图片完成的进度，stored为本地存储信息"""
+    WebSocketService.emit_to_user(
+        task.user_id,
+        'generation_progress',
+        {
+            'task_id': task.id,
+            'completed': GeneratedResult.query.filter_by(task_id=task.id).count(),
+            'total': task.quantity_requested,
+            'image_url': stored['url'],
+            'thumbnail_url': stored.get('thumbnail_url') or stored['url']
+        }
+    )
+
+def _finalize_generation(task_id):
+    """
+    所有图片（包括异步出图的第三方作业）都结束后汇总任务结果并推送最终状态
+    生成任务和轮询任务都可能调用，只有把状态从generating改掉的一方负责推送
+    """
+    generated_count = GeneratedResult.query.filter_by(task_id=task_id).count()
+    
+    values = {'quantity_succeeded': generated_count}
+    if generated_count > 0:
+        values['status'] = 'completed'
+    else:
+        values['status'] = 'failed'
+        values['error_log'] = "所有图片生成都失败了"
+    
+    updated = AITask.query.filter_by(id=task_id, status='generating').update(values, synchronize_session=False)
+    db.session.commit()
+    
+    if not updated:
+        return generated_count
+    
+    task = AITask.query.get(task_id)
+    
+    # 推送最终结果
+    if task.status == 'completed':
+        results = GeneratedResult.query.filter_by(task_id=task_id).all()
+        WebSocketService.emit_to_user(
+            task.user_id,
+            'generation_complete',
+            {
+                'task_id': task_id,
+                'images': [{
+                    'id': r.id,
+                    'url': r.image_url,
+                    'thumbnail_url': r.thumbnail_url or r.image_url,
+                    'preview_url': r.preview_url or r.image_url
+                } for r in results]
+            }
+        )
+    else:
+        WebSocketService.emit_to_user(
+            task.user_id,
+            'generation_failed',
+            {
+                'task_id': task_id,
+                'error': task.error_log
+            }
+        )
+    
+    logger.info(f"生成任务 {task_id} 完成，成功生成 {generated_count} 张图片")
+    return generated_count
+
+def _maybe_finalize_generation(task_id):
+    """任务提交结束且没有进行中的第三方作业时汇总任务"""
+    try:
+        if get_redis().exists(SUBMITTING_KEY.format(task_id=task_id)):
+            return
+    except Exception as e:
+        logger.warning(f"读取任务提交标记失败: {str(e)}")
+    
+    if ProviderJob.query.filter_by(task_id=task_id, status='pending').count() == 0:
+        _finalize_generation(task_id)
+
 @celery.task(bind=True, max_retries=3)
 def generate_task(self, task_id):
     """
@@ -116,71 +271,72 @@ def generate_task(self, task_id):
             }
         )
         
-        ai_service = AIService()
+        prompt = task.final_prompt
+        quantity = task.quantity_requested
         generated_count = 0
+        submitted_jobs = 0
         
-        # 批量生成图片
-        for i in range(task.quantity_requested):
-            try:
-                image_url = ai_service.generate_image(task.final_prompt)
+        # 提交期间轮询任务不得汇总该任务
+        submitting_key = SUBMITTING_KEY.format(task_id=task_id)
+        get_redis().set(submitting_key, 1, ex=Config.MIDJOURNEY_JOB_TIMEOUT)
+        
+        try:
+            # 按通道单次上限合并为若干批并行请求，每批完成后立即保存并推送进度
+            app = current_app._get_current_object()
+            batches = AIService().plan_batches(quantity)
+            max_workers = max(1, min(len(batches), Config.GENERATION_MAX_PARALLEL))
+            
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                futures = {
+                    executor.submit(_generate_batch, app, prompt, size): size
+                    for size in batches
+                }
                 
-                if image_url:
-                    # 保存生成结果
-                    result = GeneratedResult(
-                        task_id=task_id,
-                        image_url=image_url
-                    )
-                    db.session.add(result)
-                    generated_count += 1
+                for future in as_completed(futures):
+                    size = futures[future]
+                    try:
+                        images = future.result()
+                    except Exception as batch_error:
+                        logger.error(f"生成 {size} 张图片的批次失败: {str(batch_error)}")
+                        continue
                     
-                    # 实时推送进度
-                    WebSocketService.emit_to_user(
-                        task.user_id,
-                        'generation_progress',
-                        {
-                            'task_id': task_id,
-                            'completed': generated_count,
-                            'total': task.quantity_requested,
-                            'image_url': image_url
-                        }
-                    )
-                
-            except Exception as img_error:
-                logger.error(f"生成第 {i+1} 张图片失败: {str(img_error)}")
-                continue
+                    # 单张图片保存失败只跳过该图片，不能让整个任务重试（已生成的图片会重复生成并重复扣费）
+                    for image in images:
+                        try:
+                            if isinstance(image, PendingJob):
+                                # 异步出图的作业只记录下来，由轮询任务取回结果
+                                db.session.add(ProviderJob(
+                                    task_id=task_id,
+                                    channel_id=image.channel_id,
+                                    model_id=image.model_id,
+                                    provider=image.provider,
+                                    external_job_id=image.job_id
+                                ))
+                                db.session.commit()
+                                submitted_jobs += 1
+                                _schedule_provider_poll()
+                            
+                            elif image:
+                                # 保存生成结果
+                                db.session.add(_new_generated_result(task_id, image))
+                                db.session.commit()
+                                generated_count += 1
+                                
+                                # 实时推送进度
+                                _emit_generation_progress(task, image)
+                        
+                        except Exception as image_error:
+                            db.session.rollback()
+                            logger.error(f"保存任务 {task_id} 的生成图片失败: {str(image_error)}")
+                            continue
+        finally:
+            get_redis().delete(submitting_key)
         
-        # 更新任务状态
-        task.quantity_succeeded = generated_count
-        if generated_count > 0:
-            task.status = 'completed'
-        else:
-            task.status = 'failed'
-            task.error_log = "所有图片生成都失败了"
-        
-        db.session.commit()
-        
-        # 推送最终结果
-        if task.status == 'completed':
-            results = GeneratedResult.query.filter_by(task_id=task_id).all()
-            WebSocketService.emit_to_user(
-                task.user_id,
-                'generation_complete',
-                {
-                    'task_id': task_id,
-                    'images': [{'id': r.id, 'url': r.image_url} for r in results]
-                }
-            )
-        else:
-            WebSocketService.emit_to_user(
-                task.user_id,
-                'generation_failed',
-                {
-                    'task_id': task_id,
-                    'error': task.error_log
-                }
-            )
+        if submitted_jobs:
+            logger.info(f"生成任务 {task_id} 已提交 {submitted_jobs} 个异步作业，等待轮询结果")
         
-        logger.info(f"生成任务 {task_id} 完成，成功生成 {generated_count} 张图片")
+        # 没有进行中的异步作业时立即汇总，否则由最后完成作业的轮询任务汇总
+        _maybe_finalize_generation(task_id)
         return generated_count
         
     except Exception as e:
@@ -205,4 +361,103 @@ def generate_task(self, task_id):
         if self.request.retries < self.max_retries:
             raise self.retry(countdown=120, exc=e)
         
-        raise e
\ No newline at end of file
+        raise e
+
+def _complete_provider_job(job, image_url, error, stored=None):
+    """
+    记录第三方作业的结果，成功时保存生成结果（stored为本地存储信息）
+    作业状态只从pending更新一次，重复轮询不会产生重复结果；返回是否由本次更新
+    """
+    values = {
+        'status': 'success' if stored else 'failed',
+        'image_url': image_url,
+        'error_log': error,
+        'completed_at': datetime.utcnow()
+    }
+    updated = ProviderJob.query.filter_by(id=job.id, status='pending').update(values, synchronize_session=False)
+    
+    if updated and stored:
+        db.session.add(_new_generated_result(job.task_id, stored))
+    db.session.commit()
+    
+    return bool(updated)
+
+@celery.task
+def poll_provider_jobs():
+    """
+    轮询进行中的第三方生成作业，同一通道、同一服务商的作业合并为一次批量查询
+    """
+    try:
+        get_redis().delete(POLL_SCHEDULED_KEY)
+    except Exception as e:
+        logger.warning(f"清除轮询排期标记失败: {str(e)}")
+    
+    pending_jobs = ProviderJob.query.filter_by(status='pending').all()
+    if not pending_jobs:
+        return 0
+    
+    jobs_by_channel = {}
+    for job in pending_jobs:
+        jobs_by_channel.setdefault((job.channel_id, job.provider), []).append(job)
+    
+    ai_service = AIService()
+    deadline = datetime.utcnow() - timedelta(seconds=Config.MIDJOURNEY_JOB_TIMEOUT)
+    finished_tasks = set()
+    
+    for (channel_id, provider), jobs in jobs_by_channel.items():
+        channel = APIChannel.query.get(channel_id)
+        unavailable = None
+        if channel is None:
+            unavailable = "通道已删除"
+        elif provider not in AIService.PROVIDER_FETCHERS:
+            unavailable = f"服务商 {provider} 不支持作业查询"
+        
+        if unavailable:
+            for job in jobs:
+                if _complete_provider_job(job, None, unavailable):
+                    finished_tasks.add(job.task_id)
+            continue
+        
+        try:
+            statuses = ai_service.fetch_provider_jobs(channel, provider, [job.external_job_id for job in jobs])
+        except Exception as e:
+            logger.warning(f"通道 {channel.name} 批量查询作业失败: {str(e)}")
+            circuit_breaker.record_failure(channel_id)
+            statuses = {}
+        
+        for job in jobs:
+            image_url, error = statuses.get(job.external_job_id, (None, None))
+            
+            if not image_url and not error and job.created_at < deadline:
+                error = f"{provider} 作业超时"
+            
+            if not image_url and not error:
+                continue
+            
+            try:
+                stored = _ingest_image(image_url) if image_url else None
+                if image_url and not stored:
+                    error = "保存生成图片失败"
+                
+                if not _complete_provider_job(job, image_url, error, stored):
+                    continue
+                
+                finished_tasks.add(job.task_id)
+                if stored:
+                    _emit_generation_progress(AITask.query.get(job.task_id), stored)
+                else:
+                    logger.error(f"作业 {job.external_job_id} 失败: {error}")
+            
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"保存作业 {job.external_job_id} 结果失败: {str(e)}")
+    
+    for task_id in finished_tasks:
+        _maybe_finalize_generation(task_id)
+    
+    remaining = ProviderJob.query.filter_by(status='pending').count()
+    if remaining:
+        _schedule_provider_poll()
+    
+    logger.info(f"作业轮询完成，{len(pending_jobs) - remaining} 个作业结束，剩余 {remaining} 个")
+    return remaining
@@ -1,6 +1,8 @@
 from celery_app import celery
 from models import db, APIChannel, APIModel
-import requests
+from services.http_pool import HTTPSessionPool
+from services.circuit_breaker import circuit_breaker
+from services.routing_table import routing_table
 import time
 import logging
 from datetime import datetime
@@ -22,7 +24,10 @@ def check_api_health():
         except Exception as e:
             logger.error(f"检查通道 {channel.name} 健康状态失败: {str(e)}")
     
-    logger.info("API健康检查完成")
+    # 健康状态可能已变化，通知所有进程重新加载路由表
+    routing_table.invalidate()
+    
+    logger.info(f"API健康检查完成，HTTP连接池统计: {HTTPSessionPool.stats()}")
 
 def check_single_channel(channel):
     """检查单个通道的健康状态"""
@@ -36,7 +41,7 @@ def check_single_channel(channel):
             health_check_gemini(channel)
         else:
             # 通用健康检查 - 简单的HTTP请求
-            response = requests.get(f"{channel.base_url}/health", timeout=10)
+            response = HTTPSessionPool.get_session(channel.base_url).get(f"{channel.base_url}/health", timeout=10)
             response.raise_for_status()
         
         end_time = time.time()
@@ -51,6 +56,9 @@ def check_single_channel(channel):
         for model in channel.api_models:
             model.is_available = True
         
+        # 健康检查本身即一次成功的试探，解除熔断
+        circuit_breaker.reset(channel.id)
+        
         logger.info(f"通道 {channel.name} 健康检查通过，延迟: {latency}ms")
         
     except Exception as e:
@@ -75,7 +83,7 @@ def health_check_openai(channel):
         'Content-Type': 'application/json'
     }
     
-    response = requests.get(url, headers=headers, timeout=10)
+    response = HTTPSessionPool.get_session(channel.base_url).get(url, headers=headers, timeout=10)
     response.raise_for_status()
     
     # 检查返回的模型列表
@@ -88,7 +96,7 @@ def health_check_gemini(channel):
     url = f"{channel.base_url}/v1/models"
     params = {'key': channel.api_key}
     
-    response = requests.get(url, params=params, timeout=10)
+    response = HTTPSessionPool.get_session(channel.base_url).get(url, params=params, timeout=10)
     response.raise_for_status()
     
     result = response.json()
@@ -114,6 +122,7 @@ def update_model_availability():
             logger.error(f"更新通道 {channel.name} 模型可用性失败: {str(e)}")
     
     db.session.commit()
+    routing_table.invalidate()
     logger.info("模型可用性更新完成")
 
 def update_openai_models(channel):
@@ -124,7 +133,7 @@ def update_openai_models(channel):
         'Content-Type': 'application/json'
     }
     
-    response = requests.get(url, headers=headers, timeout=10)
+    response = HTTPSessionPool.get_session(channel.base_url).get(url, headers=headers, timeout=10)
     response.raise_for_status()
     
     result = response.json()
@@ -139,7 +148,7 @@ def update_gemini_models(channel):
     url = f"{channel.base_url}/v1/models"
     params = {'key': channel.api_key}
     
-    response = requests.get(url, params=params, timeout=10)
+    response = HTTPSessionPool.get_session(channel.base_url).get(url, params=params, timeout=10)
     response.raise_for_status()
     
     result = response.json()
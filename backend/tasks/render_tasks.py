@@ -0,0 +1,148 @@
+from celery_app import celery
+from celery import group
+from models import db, AITask, GeneratedResult
+from services.image_service import ImageService
+from services.websocket_service import WebSocketService
+from utils.redis_client import get_redis
+import traceback
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 渲染作业归属 {job_id: user_id}，用于查询作业状态时校验权限
+RENDER_JOB_OWNER_KEY = 'vm:render:job:{job_id}:owner'
+RENDER_JOB_OWNER_TTL = 86400
+
+def register_render_job(job_id, user_id):
+    """记录渲染作业所属用户"""
+    get_redis().set(RENDER_JOB_OWNER_KEY.format(job_id=job_id), user_id, ex=RENDER_JOB_OWNER_TTL)
+
+def get_render_job_owner(job_id):
+    """获取渲染作业所属用户，不存在时返回None"""
+    owner = get_redis().get(RENDER_JOB_OWNER_KEY.format(job_id=job_id))
+    return int(owner) if owner else None
+
+# 批量定稿进度 {total, done, completed, failed} 与各项结果 {result_id: 定稿URL，失败为空}
+RENDER_BATCH_KEY = 'vm:render:batch:{batch_id}'
+RENDER_BATCH_ITEMS_KEY = 'vm:render:batch:{batch_id}:items'
+
+def start_render_batch(batch_id, user_id, result_ids, editor_data):
+    """创建批量定稿并把每张图片作为独立的渲染任务并行提交到render队列"""
+    redis_client = get_redis()
+    batch_key = RENDER_BATCH_KEY.format(batch_id=batch_id)
+    
+    register_render_job(batch_id, user_id)
+    pipe = redis_client.pipeline()
+    pipe.hset(batch_key, mapping={'total': len(result_ids), 'done': 0, 'completed': 0, 'failed': 0})
+    pipe.expire(batch_key, RENDER_JOB_OWNER_TTL)
+    pipe.execute()
+    
+    group(finalize_task.s(result_id, editor_data, batch_id) for result_id in result_ids).apply_async()
+
+def get_render_batch(batch_id):
+    """获取批量定稿进度，不存在时返回None"""
+    redis_client = get_redis()
+    progress = redis_client.hgetall(RENDER_BATCH_KEY.format(batch_id=batch_id))
+    if not progress:
+        return None
+    
+    items = redis_client.hgetall(RENDER_BATCH_ITEMS_KEY.format(batch_id=batch_id))
+    return {
+        'total': int(progress[b'total']),
+        'completed': int(progress[b'completed']),
+        'failed': int(progress[b'failed']),
+        'items': [
+            {'result_id': int(result_id), 'finalized_image_url': url.decode() or None}
+            for result_id, url in items.items()
+        ]
+    }
+
+def _record_batch_item(batch_id, user_id, result_id, finalized_url):
+    """记录批量定稿中一项的结果，最后一项完成时推送批量完成事件"""
+    redis_client = get_redis()
+    batch_key = RENDER_BATCH_KEY.format(batch_id=batch_id)
+    items_key = RENDER_BATCH_ITEMS_KEY.format(batch_id=batch_id)
+    
+    pipe = redis_client.pipeline()
+    pipe.hset(items_key, result_id, finalized_url or '')
+    pipe.expire(items_key, RENDER_JOB_OWNER_TTL)
+    pipe.hincrby(batch_key, 'completed' if finalized_url else 'failed', 1)
+    pipe.hincrby(batch_key, 'done', 1)
+    pipe.hmget(batch_key, 'total', 'completed', 'failed')
+    done, (total, completed, failed) = pipe.execute()[-2:]
+    
+    # done计数原子递增，只有完成最后一项的任务会推送
+    if done == int(total):
+        WebSocketService.emit_to_user(
+            user_id,
+            'finalize_batch_complete',
+            {
+                'batch_id': batch_id,
+                'total': int(total),
+                'completed': int(completed),
+                'failed': int(failed)
+            }
+        )
+
+@celery.task(bind=True)
+def finalize_task(self, result_id, editor_data, batch_id=None):
+    """
+    定稿渲染任务 - 在独立的render队列中执行Pillow合成，不占用Web请求线程
+    批量定稿时各项共用worker进程内的字体和叠加素材缓存
+    """
+    user_id = None
+    try:
+        result = GeneratedResult.query.get(result_id)
+        if not result:
+            raise Exception(f"生成结果 {result_id} 不存在")
+        
+        user_id = AITask.query.get(result.task_id).user_id
+        
+        # 使用图片处理服务生成最终图片
+        image_service = ImageService()
+        finalized_url = image_service.apply_editor_data(result.image_url, editor_data)
+        
+        # 保存编辑数据和最终图片URL
+        result.editor_data_json = json.dumps(editor_data)
+        result.finalized_image_url = finalized_url
+        db.session.commit()
+        
+        WebSocketService.emit_to_user(
+            user_id,
+            'finalize_complete',
+            {
+                'job_id': self.request.id,
+                'batch_id': batch_id,
+                'result_id': result_id,
+                'finalized_image_url': finalized_url
+            }
+        )
+        
+        if batch_id:
+            _record_batch_item(batch_id, user_id, result_id, finalized_url)
+        
+        logger.info(f"定稿渲染 {result_id} 完成")
+        return {'result_id': result_id, 'finalized_image_url': finalized_url}
+    
+    except Exception as e:
+        error_msg = str(e)
+        logger.error(f"定稿渲染 {result_id} 失败: {error_msg}")
+        logger.error(traceback.format_exc())
+        
+        if user_id:
+            WebSocketService.emit_to_user(
+                user_id,
+                'finalize_failed',
+                {
+                    'job_id': self.request.id,
+                    'batch_id': batch_id,
+                    'result_id': result_id,
+                    'error': '图片编辑失败'
+                }
+            )
+        
+        if batch_id:
+            _record_batch_item(batch_id, user_id or get_render_job_owner(batch_id), result_id, None)
+        
+        raise e
@@ -3,32 +3,40 @@ from flask import request, jsonify, current_app
 import jwt
 from models import User
 
+def _decode_user(token):
+    """
+    校验访问令牌并返回 (用户, None)，校验失败时返回 (None, 错误响应)
+    """
+    if not token:
+        return None, (jsonify({'error': '未提供访问令牌'}), 401)
+    
+    try:
+        # 移除 "Bearer " 前缀
+        if token.startswith('Bearer '):
+            token = token[7:]
+        
+        # 解码token
+        secret_key = current_app.config.get('JWT_SECRET_KEY', current_app.config['SECRET_KEY'])
+        payload = jwt.decode(token, secret_key, algorithms=['HS256'])
+        current_user = User.query.get(payload['user_id'])
+        
+        if not current_user:
+            return None, (jsonify({'error': '用户不存在'}), 401)
+            
+    except jwt.ExpiredSignatureError:
+        return None, (jsonify({'error': 'Token已过期'}), 401)
+    except jwt.InvalidTokenError:
+        return None, (jsonify({'error': '无效的Token'}), 401)
+    
+    return current_user, None
+
 def token_required(f):
     """用户身份验证装饰器"""
     @wraps(f)
     def decorated(*args, **kwargs):
-        token = request.headers.get('Authorization')
-        
-        if not token:
-            return jsonify({'error': '未提供访问令牌'}), 401
-        
-        try:
-            # 移除 "Bearer " 前缀
-            if token.startswith('Bearer '):
-                token = token[7:]
-            
-            # 解码token
-            secret_key = current_app.config.get('JWT_SECRET_KEY', current_app.config['SECRET_KEY'])
-            payload = jwt.decode(token, secret_key, algorithms=['HS256'])
-            current_user = User.query.get(payload['user_id'])
-            
-            if not current_user:
-                return jsonify({'error': '用户不存在'}), 401
-                
-        except jwt.ExpiredSignatureError:
-            return jsonify({'error': 'Token已过期'}), 401
-        except jwt.InvalidTokenError:
-            return jsonify({'error': '无效的Token'}), 401
+        current_user, error = _decode_user(request.headers.get('Authorization'))
+        if error:
+            return error
         
         return f(current_user, *args, **kwargs)
     
@@ -38,30 +46,29 @@ def admin_required(f):
     """管理员权限装饰器"""
     @wraps(f)
     def decorated(*args, **kwargs):
-        token = request.headers.get('Authorization')
+        current_user, error = _decode_user(request.headers.get('Authorization'))
+        if error:
+            return error
         
-        if not token:
-            return jsonify({'error': '未提供访问令牌'}), 401
+        if current_user.role != 'admin':
+            return jsonify({'error': '权限不足'}), 403
         
-        try:
-            if token.startswith('Bearer '):
-                token = token[7:]
-            
-            secret_key = current_app.config.get('JWT_SECRET_KEY', current_app.config['SECRET_KEY'])
-            payload = jwt.decode(token, secret_key, algorithms=['HS256'])
-            current_user = User.query.get(payload['user_id'])
-            
-            if not current_user:
-                return jsonify({'error': '用户不存在'}), 401
-            
-            if current_user.role != 'admin':
-                return jsonify({'error': '权限不足'}), 403
-                
-        except jwt.ExpiredSignatureError:
-            return jsonify({'error': 'Token已过期'}), 401
-        except jwt.InvalidTokenError:
-            return jsonify({'error': '无效的Token'}), 401
+        return f(current_user, *args, **kwargs)
+    
+    return decorated
+
+def stream_token_required(f):
+    """
+    事件流接口的身份验证装饰器（EventSource不能设置请求头，允许通过token查询参数传递）
+    查询参数中的令牌会出现在访问日志的请求行中，nginx和gunicorn的访问日志已配置为不记录查询参数
+    """
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        token = request.headers.get('Authorization') or request.args.get('token')
+        current_user, error = _decode_user(token)
+        if error:
+            return error
         
         return f(current_user, *args, **kwargs)
     
-    return decorated
\ No newline at end of file
+    return decorated
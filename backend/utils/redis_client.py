@@ -0,0 +1,28 @@
+import redis
+from config import Config
+
+_client = None
+
+def get_redis() -> redis.Redis:
+    """获取进程内共享的Redis客户端（连接池在fork后会自动重建）"""
+    global _client
+    if _client is None:
+        _client = redis.Redis.from_url(
+            Config.REDIS_URL,
+            socket_timeout=Config.REDIS_SOCKET_TIMEOUT,
+            socket_connect_timeout=Config.REDIS_SOCKET_TIMEOUT
+        )
+    return _client
+
+_pubsub_client = None
+
+def get_pubsub_redis() -> redis.Redis:
+    """获取用于订阅的Redis客户端（订阅需要长时间阻塞读取，不设置读超时）"""
+    global _pubsub_client
+    if _pubsub_client is None:
+        _pubsub_client = redis.Redis.from_url(
+            Config.REDIS_URL,
+            socket_connect_timeout=Config.REDIS_SOCKET_TIMEOUT,
+            health_check_interval=30
+        )
+    return _pubsub_client